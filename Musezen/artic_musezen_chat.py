@@ -1,15 +1,19 @@
 import streamlit as st
-import time
-import numpy as np
 import os
 from musezen.generative_components.agent import ChatAgent
+from musezen.generative_components.agent_history import HistoryManager, llm_summarizer
+from musezen.generative_components.agent_response_cache import SemanticResponseCache
 from musezen.generative_components.llm_client_openai import OpenAIClient
 from musezen.generative_components.tool_artsy import (
     SearchGene,
     SearchArtist,
     FetchAPILinks,
 )
+from musezen.generative_components.artsy_prefetch import PrefetchJob, StylePrefetcher
 from musezen.cv_components.musezen_cv_foundation import musezen_cv
+from musezen.cv_components.musezen_cv_batching import CVBatchQueue
+from musezen.cv_components.musezen_cv_cache import ImageResultCache
+from musezen.cv_components.musezen_cv_similarity import ArtworkIndex
 
 # Local environment
 # import dotenv
@@ -28,8 +32,10 @@ PROVIDERS = {
 # Keys to persist certain objects in session state
 CHAT_DISPLAY_KEY = "chat_display"
 MUSEZEN_AGENT_KEY = "musezen_agent"
-CV_MODEL_KEY = "cv_model"
 PAINTING_CLASS_KEY = "painting_class"
+SIMILAR_ARTWORKS_KEY = "similar_artworks"
+SIMILAR_ARTWORKS_UPLOAD_KEY = "similar_artworks_upload"
+PREFETCH_JOB_KEY = "prefetch_job"
 CONTEXT_ADDED_KEY = "context_added"
 
 WELCOME_MESSAGE = (
@@ -40,6 +46,78 @@ WELCOME_MESSAGE = (
 #############
 # Functions #
 #############
+@st.cache_resource(show_spinner=False)
+def get_cv_model():
+    """
+    Load the style classifier once per process; every session shares the same read-only instance.
+    Set MUSEZEN_CV_BACKEND=onnx to serve it through ONNX Runtime, or MUSEZEN_CV_MODE=fast to use
+    the quantized torch CPU inference mode, calibrated on the paintings in MUSEZEN_CV_SAMPLES.
+    The torch model loads on a background thread so the page renders before it is ready.
+    """
+    if os.environ.get("MUSEZEN_CV_BACKEND", "torch") == "onnx":
+        from musezen.cv_components.musezen_cv_onnx import musezen_cv_onnx
+
+        return musezen_cv_onnx()
+    return musezen_cv(
+        mode=os.environ.get("MUSEZEN_CV_MODE", "fp32"), background_warmup=True
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_cv_queue():
+    """
+    Batch concurrent uploads from all sessions into shared forward passes, answering repeat
+    uploads of the same artwork from the cache
+    """
+    return CVBatchQueue(
+        get_cv_model(),
+        max_batch_size=16,
+        max_wait_ms=10,
+        cache=ImageResultCache(max_size=1024),
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_similarity_index():
+    """
+    Load the similar-artworks index built by musezen_cv_similarity, if MUSEZEN_SIMILARITY_INDEX
+    points to one. Requires the fp32 torch backend for embeddings.
+    """
+    index_dir = os.environ.get("MUSEZEN_SIMILARITY_INDEX")
+    if not index_dir:
+        return None
+    backend = os.environ.get("MUSEZEN_CV_BACKEND", "torch")
+    mode = os.environ.get("MUSEZEN_CV_MODE", "fp32")
+    if backend != "torch" or mode != "fp32":
+        print(f"Similar artworks disabled, the {backend}/{mode} classifier has no embeddings")
+        return None
+    return ArtworkIndex(index_dir)
+
+
+@st.cache_resource(show_spinner=False)
+def get_prefetcher():
+    """
+    Warm the Artsy response cache for the predicted style while the user types; the worker pool
+    is shared by all sessions to bound the extra API traffic
+    """
+    return StylePrefetcher(max_workers=4, budget=20, max_artists=5)
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    """
+    Answers to frequent first-turn questions ("what is Impressionism?"), shared by all sessions
+    """
+    return SemanticResponseCache(max_size=1024, ttl=24 * 60 * 60, threshold=0.85)
+
+
+def cancel_prefetch():
+    job: PrefetchJob | None = st.session_state.get(PREFETCH_JOB_KEY)
+    if job is not None:
+        job.cancel()
+    st.session_state[PREFETCH_JOB_KEY] = None
+
+
 def display_messages():
     """
     This function displays chat messages with a fixed opener
@@ -61,9 +139,11 @@ def clear():
         {"role": "assistant", "content": WELCOME_MESSAGE}
     ]
     st.session_state[MUSEZEN_AGENT_KEY] = None
-    st.session_state[CV_MODEL_KEY] = musezen_cv()
     st.session_state[PAINTING_CLASS_KEY] = None
+    st.session_state[SIMILAR_ARTWORKS_KEY] = []
+    st.session_state[SIMILAR_ARTWORKS_UPLOAD_KEY] = None
     st.session_state[CONTEXT_ADDED_KEY] = False
+    cancel_prefetch()
 
 
 def on_file_change():
@@ -76,6 +156,8 @@ def on_file_change():
     delete file -> False
     """
     st.session_state[CONTEXT_ADDED_KEY] = False
+    # The prefetched context belongs to the previous upload
+    cancel_prefetch()
 
 
 ##############
@@ -88,16 +170,42 @@ st.set_page_config(
     initial_sidebar_state="auto",
 )
 
+# Load the shared CV model at startup instead of on the first upload
+get_cv_queue()
+
 ### Sidebar ###
 st.sidebar.header("Photo Upload")
 # Receive painting pictures
-uploaded_painting = st.sidebar.file_uploader("Upload photos here", type=["png", "jpg"])
+uploaded_painting = st.sidebar.file_uploader(
+    "Upload photos here", type=["png", "jpg"], on_change=on_file_change
+)
 # If there is a file and the context has not been added yet.
 if uploaded_painting is not None and not st.session_state[CONTEXT_ADDED_KEY]:
-    cv_model: musezen_cv = st.session_state[CV_MODEL_KEY]
-    painting_style = cv_model.classify(uploaded_painting)
+    cv_queue: CVBatchQueue = get_cv_queue()
+    painting_style = cv_queue.classify(uploaded_painting)
     st.sidebar.write(f"You uploaded a painting in **{painting_style}**")
     st.session_state[PAINTING_CLASS_KEY] = painting_style
+    # Reruns classify the same upload again, only start one prefetch per upload
+    job: PrefetchJob | None = st.session_state.get(PREFETCH_JOB_KEY)
+    if job is None or job.style != painting_style:
+        cancel_prefetch()
+        st.session_state[PREFETCH_JOB_KEY] = get_prefetcher().prefetch(painting_style)
+    similarity_index = get_similarity_index()
+    # The embedding is a full forward pass, compute it once per upload rather than on every rerun
+    if similarity_index is not None and (
+        st.session_state.get(SIMILAR_ARTWORKS_UPLOAD_KEY) != uploaded_painting.file_id
+    ):
+        uploaded_painting.seek(0)
+        embedding = get_cv_model().embed([uploaded_painting]).numpy()
+        st.session_state[SIMILAR_ARTWORKS_KEY] = [
+            os.path.splitext(os.path.basename(label))[0]
+            for label, _ in similarity_index.search(embedding, k=3)[0]
+        ]
+        st.session_state[SIMILAR_ARTWORKS_UPLOAD_KEY] = uploaded_painting.file_id
+    if similarity_index is not None and st.session_state.get(SIMILAR_ARTWORKS_KEY):
+        st.sidebar.write(
+            f"It looks similar to: {', '.join(st.session_state[SIMILAR_ARTWORKS_KEY])}"
+        )
 
 
 st.sidebar.header("Settings")
@@ -144,13 +252,16 @@ if (MUSEZEN_AGENT_KEY not in st.session_state) or (
             {"role": "assistant", "content": WELCOME_MESSAGE},
         ],
         tools=[SearchGene, SearchArtist, FetchAPILinks],
+        # Keep the prompt size flat over long conversations
+        history_manager=HistoryManager(summarize=llm_summarizer(llm)),
+        response_cache=get_response_cache(),
     )
 
 # Initialize variables to keep track of CV processes
-if CV_MODEL_KEY not in st.session_state:
-    st.session_state[CV_MODEL_KEY] = musezen_cv()
 if PAINTING_CLASS_KEY not in st.session_state:
     st.session_state[PAINTING_CLASS_KEY] = None
+if SIMILAR_ARTWORKS_KEY not in st.session_state:
+    st.session_state[SIMILAR_ARTWORKS_KEY] = []
 if CONTEXT_ADDED_KEY not in st.session_state:
     st.session_state[CONTEXT_ADDED_KEY] = False
 
@@ -183,33 +294,40 @@ if prompt := st.chat_input("Type here"):
 
     with st.chat_message("assistant"):
         # Thought process
-        with st.status("Typing...", expanded=False) as status:
+        status = st.status("Typing...", expanded=False)
+        message_placeholder = st.empty()
+        with status:
             agent: ChatAgent = st.session_state[MUSEZEN_AGENT_KEY]
 
+            # The answer of a first question only depends on the question and the predicted style,
+            # unless similar artworks are part of the context
+            cache_context = {"question": prompt}
+
             # Add image context to user prompt if image is uploaded and context has not been uploaded
             # in previous user messages
             if uploaded_painting is not None and not st.session_state[CONTEXT_ADDED_KEY]:
-                prompt = (
-                    f"Context: the user uploaded image with the style of {st.session_state[PAINTING_CLASS_KEY]}\nAnd Here is the user prompt:\n"
-                    + prompt
-                )
+                context = f"Context: the user uploaded image with the style of {st.session_state[PAINTING_CLASS_KEY]}\n"
+                if st.session_state[SIMILAR_ARTWORKS_KEY]:
+                    context += f"It looks similar to these artworks: {', '.join(st.session_state[SIMILAR_ARTWORKS_KEY])}\n"
+                cache_context["style"] = st.session_state[PAINTING_CLASS_KEY]
+                if st.session_state[SIMILAR_ARTWORKS_KEY]:
+                    cache_context = None
+                prompt = context + "And Here is the user prompt:\n" + prompt
                 # Set the flag to true
                 st.session_state[CONTEXT_ADDED_KEY] = True
 
-            # Get response from the agent
-            response = agent.invoke(input_message=prompt, model=model)
-            status.update(label="Finished!", state="complete", expanded=False)
+            # Stream the response from the agent as the model generates it, tool progress is
+            # still written into the status box
+            response = ""
+            for token in agent.stream(
+                input_message=prompt, model=model, cache_context=cache_context
+            ):
+                response += token
+                message_placeholder.markdown(response + " ▌")
+        status.update(label="Finished!", state="complete", expanded=False)
 
         # Display response
-        message_placeholder = st.empty()
-        full_response = ""
-        for item in response.split(" "):
-            full_response += item + " "
-            message_placeholder.markdown(full_response + " ▌")
-            time.sleep(
-                np.random.choice([0, 0, 1, 1, 2, 2, 3], 1)[0] / 100
-            )  # For streaming effect
-        message_placeholder.write(full_response)
+        message_placeholder.write(response)
 
         # Update chat display
         st.session_state[CHAT_DISPLAY_KEY].append(
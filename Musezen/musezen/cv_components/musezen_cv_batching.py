@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from io import BytesIO
+
+from musezen.cv_components.musezen_cv_cache import ImageResultCache, read_image_bytes
+
+
+class CVBatchQueue:
+    """
+    Collects concurrent `classify` calls from different sessions and runs them through the shared
+    model as one batched forward pass.
+
+    Decoding and preprocessing happen in the calling thread, so they still run in parallel; only
+    the forward pass is serialized on the worker thread.
+    """
+
+    def __init__(
+        self,
+        cv_model,
+        max_batch_size: int = 16,
+        max_wait_ms: float = 10,
+        cache: ImageResultCache | None = None,
+    ):
+        """
+        Start the batching worker.
+
+        Args:
+            cv_model (musezen_cv | musezen_cv_onnx): The classifier to run batches on.
+            max_batch_size (int, optional): The largest batch sent to the model. Defaults to 16.
+            max_wait_ms (float, optional): How long the first request of a batch waits for others
+                to join it. Defaults to 10 ms.
+            cache (ImageResultCache | None, optional): Results cache checked before an image is
+                queued. Defaults to None.
+        """
+        self.cv_model = cv_model
+        self.cache = cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(
+            target=self._run, name="musezen-cv-batcher", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, img_bytes) -> Future:
+        """
+        Queue an image for classification.
+
+        Args:
+            img_bytes: A path or file-like object holding the image.
+
+        Returns:
+            Future: Resolves to the result of this image only, a dictionary with the predicted
+                `style` and the `scores` of every style.
+        """
+        future = Future()
+        try:
+            if self.cache is not None:
+                data = read_image_bytes(img_bytes)
+                keys = self.cache.keys(data)
+                cached = self.cache.get(keys)
+                if cached is not None:
+                    future.set_result(cached)
+                    return future
+                future.add_done_callback(
+                    lambda f: not f.cancelled()
+                    and f.exception() is None
+                    and self.cache.put(keys, f.result())
+                )
+                img_bytes = BytesIO(data)
+            img_tensor = self.cv_model.preprocess(img_bytes)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self._requests.put((img_tensor, future))
+        return future
+
+    def classify(self, img_bytes, timeout: float | None = None) -> str:
+        """Drop-in replacement for `musezen_cv.classify` that goes through the batch queue."""
+        return self.submit(img_bytes).result(timeout=timeout)["style"]
+
+    def _collect_batch(self) -> list[tuple]:
+        """Block for the first request, then gather more until the batch is full or the wait expires."""
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            # Skip requests whose callers already gave up
+            batch = [(t, f) for t, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                predictions = self.cv_model.predict_with_scores(
+                    self.cv_model.collate([t for t, _ in batch])
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
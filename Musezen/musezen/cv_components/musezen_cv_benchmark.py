@@ -0,0 +1,345 @@
+import argparse
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from musezen.cv_components.musezen_cv_preprocessing import decode_image, to_array
+
+# Metrics compared against the baseline, and whether higher values are better. Latencies are
+# compared per image size on their median, tail percentiles of a few dozen samples are noise
+TRACKED_METRICS = {
+    "cold_load_s": False,
+    "peak_rss_mb": False,
+}
+TRACKED_STAGE_METRICS = [
+    "decode_ms_p50",
+    "preprocess_ms_p50",
+    "forward_ms_p50",
+    "classify_ms_p50",
+]
+# A change only counts as a regression beyond this many times the runs' relative spread
+NOISE_FACTOR = 3.0
+
+
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """A smooth random JPEG of the given size, close enough to a photo for decode timings."""
+    rng = np.random.default_rng(seed)
+    low_res = Image.fromarray((rng.random((6, 8, 3)) * 255).astype(np.uint8))
+    buffer = BytesIO()
+    low_res.resize((width, height), Image.BICUBIC).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _summary(samples: list[float], prefix: str) -> dict:
+    """
+    Median, p90 and mean of latencies, plus the relative spread of the median: the median
+    absolute deviation divided by the median.
+    """
+    samples_ms = np.array(samples) * 1000
+    median = float(np.median(samples_ms))
+    return {
+        f"{prefix}_ms_p50": median,
+        f"{prefix}_ms_p90": float(np.percentile(samples_ms, 90)),
+        f"{prefix}_ms_mean": float(samples_ms.mean()),
+        f"{prefix}_ms_spread": float(np.median(np.abs(samples_ms - median)) / median)
+        if median
+        else 0.0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def load_model(backend: str, mode: str, weights: str | None):
+    """Build the classifier under test."""
+    if backend == "onnx":
+        from musezen.cv_components.musezen_cv_onnx import musezen_cv_onnx
+
+        if weights:
+            return musezen_cv_onnx(
+                onnx_path=weights.rsplit(".", 1)[0] + ".onnx", model_weight_path=weights
+            )
+        return musezen_cv_onnx()
+    from musezen.cv_components.musezen_cv_foundation import musezen_cv
+
+    return musezen_cv(weights, mode=mode) if weights else musezen_cv(mode=mode)
+
+
+def measure_cold_load(backend: str, mode: str, weights: str | None, runs: int = 3) -> dict:
+    """Median time of imports plus model construction in a fresh interpreter."""
+    results = [_cold_load(backend, mode, weights) for _ in range(runs)]
+    return {
+        "cold_load_s": float(np.median([r["seconds"] for r in results])),
+        "cold_load_rss_mb": float(np.median([r["rss"] for r in results])) / 1024,
+    }
+
+
+def _cold_load(backend: str, mode: str, weights: str | None) -> dict:
+    code = (
+        "import time, json, resource; start = time.perf_counter();"
+        "from musezen.cv_components.musezen_cv_benchmark import load_model;"
+        f"load_model({backend!r}, {mode!r}, {weights!r});"
+        "print(json.dumps({'seconds': time.perf_counter() - start,"
+        "'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_stages(cv, images: dict[str, list[bytes]], repeats: int) -> dict:
+    """
+    Per-image latency of decode, preprocess, forward, and the whole classify call, for every
+    group of images of the same size: a 12 MP decode takes ten times a VGA one, so pooling them
+    would make every percentile a mix of two clusters.
+    """
+    return {
+        label: _measure_group(cv, group, repeats) for label, group in images.items()
+    }
+
+
+def _measure_group(cv, images: list[bytes], repeats: int) -> dict:
+    normalize = getattr(cv, "normalize_input", True)
+    decode, preprocess, forward, classify = [], [], [], []
+    # The first pass warms up allocator pools and caches
+    for repeat in range(repeats + 1):
+        for data in images:
+            start = time.perf_counter()
+            image = decode_image(BytesIO(data))
+            decoded = time.perf_counter()
+            batch = cv.collate([to_array(image, normalize)])
+            preprocessed = time.perf_counter()
+            cv.predict(batch)
+            done = time.perf_counter()
+            decode.append(decoded - start)
+            preprocess.append(preprocessed - decoded)
+            forward.append(done - preprocessed)
+
+            start = time.perf_counter()
+            cv.classify(BytesIO(data))
+            if repeat:
+                classify.append(time.perf_counter() - start)
+            else:
+                decode.pop(), preprocess.pop(), forward.pop()
+    return {
+        "samples": len(classify),
+        **_summary(decode, "decode"),
+        **_summary(preprocess, "preprocess"),
+        **_summary(forward, "forward"),
+        **_summary(classify, "classify"),
+    }
+
+
+def measure_throughput(
+    cv, image: bytes, batch_sizes: list[int], threads: list[int], repeats: int
+) -> list[dict]:
+    """Images/sec of the forward pass for every batch size and thread count combination."""
+    results = []
+    single = cv.collate([cv.preprocess(BytesIO(image))])
+    for num_threads in threads:
+        if hasattr(cv, "session"):
+            # ONNX Runtime fixes its thread pool at session creation
+            if num_threads != threads[0]:
+                continue
+        else:
+            import torch
+
+            torch.set_num_threads(num_threads)
+        for batch_size in batch_sizes:
+            batch = cv.collate([single[0]] * batch_size)
+            cv.predict(batch)
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                cv.predict(batch)
+                timings.append(time.perf_counter() - start)
+            summary = _summary(timings, "batch")
+            results.append(
+                {
+                    "threads": num_threads,
+                    "batch_size": batch_size,
+                    "images_per_sec": batch_size / summary["batch_ms_p50"] * 1000,
+                    "batch_ms": summary["batch_ms_p50"],
+                    "batch_ms_spread": summary["batch_ms_spread"],
+                }
+            )
+    return results
+
+
+def compare(
+    report: dict, baseline: dict, tolerance: float, noise_factor: float = NOISE_FACTOR
+) -> list[str]:
+    """
+    List the tracked metrics that regressed against the baseline.
+
+    A stage latency regresses when its median grows by more than `tolerance`, and by more than
+    `noise_factor` times the larger relative spread of the two runs, so a noisy machine widens
+    the gate instead of failing at random.
+    """
+    regressions = []
+    for label, stages in report.get("stages", {}).items():
+        before_stages = baseline.get("stages", {}).get(label)
+        if not before_stages:
+            continue
+        for metric in TRACKED_STAGE_METRICS:
+            before, after = before_stages.get(metric), stages.get(metric)
+            if not before or after is None:
+                continue
+            spread_metric = metric.replace("_p50", "_spread")
+            noise = max(stages.get(spread_metric, 0.0), before_stages.get(spread_metric, 0.0))
+            allowed = max(tolerance, noise_factor * noise)
+            change = (after - before) / before
+            if change > allowed:
+                regressions.append(
+                    f"{label} {metric}: {before:.3f} -> {after:.3f} ({change:+.1%}, "
+                    f"allowed {allowed:.1%})"
+                )
+    for metric, higher_is_better in TRACKED_METRICS.items():
+        if metric not in report or metric not in baseline or not baseline[metric]:
+            continue
+        change = (report[metric] - baseline[metric]) / baseline[metric]
+        if higher_is_better:
+            change = -change
+        if change > tolerance:
+            regressions.append(
+                f"{metric}: {baseline[metric]:.3f} -> {report[metric]:.3f} ({change:+.1%})"
+            )
+    baseline_throughput = {
+        (r["threads"], r["batch_size"]): r for r in baseline.get("throughput", [])
+    }
+    for row in report.get("throughput", []):
+        before = baseline_throughput.get((row["threads"], row["batch_size"]))
+        if not before or not before["images_per_sec"]:
+            continue
+        noise = max(row.get("batch_ms_spread", 0.0), before.get("batch_ms_spread", 0.0))
+        allowed = max(tolerance, noise_factor * noise)
+        change = (before["images_per_sec"] - row["images_per_sec"]) / before["images_per_sec"]
+        if change > allowed:
+            regressions.append(
+                f"images_per_sec threads={row['threads']} batch={row['batch_size']}: "
+                f"{before['images_per_sec']:.1f} -> {row['images_per_sec']:.1f} "
+                f"({-change:+.1%}, allowed {allowed:.1%})"
+            )
+    return regressions
+
+
+def run_benchmark(
+    backend: str = "torch",
+    mode: str = "fp32",
+    weights: str | None = None,
+    sample_images: list[str] | None = None,
+    synthetic_sizes: list[tuple[int, int]] = [(640, 480), (4032, 3024)],
+    batch_sizes: list[int] = [1, 4, 16],
+    threads: list[int] = [1, 2, 4],
+    repeats: int = 30,
+    throughput_repeats: int = 10,
+    cold_load: bool = True,
+) -> dict:
+    """
+    Run the whole benchmark and return a machine-readable report.
+
+    Args:
+        backend (str, optional): "torch" or "onnx". Defaults to "torch".
+        mode (str, optional): The torch inference mode, "fp32" or "fast". Defaults to "fp32".
+        weights (str | None, optional): Path to the model weights. Defaults to the app's path.
+        sample_images (list[str] | None, optional): Real images to time besides the synthetic
+            ones. Defaults to None.
+        synthetic_sizes (list[tuple[int, int]], optional): Sizes of the synthetic JPEGs.
+            Defaults to VGA and 12 MP.
+        batch_sizes (list[int], optional): Batch sizes for the throughput sweep.
+        threads (list[int], optional): `torch.set_num_threads` values for the sweep.
+        repeats (int, optional): Timed runs of every image for the stage latencies. Defaults
+            to 30.
+        throughput_repeats (int, optional): Timed forward passes per throughput setting.
+            Defaults to 10.
+        cold_load (bool, optional): Also measure import + load time in a subprocess. Defaults to
+            True.
+
+    Returns:
+        dict: The report.
+    """
+    images = {
+        f"{w}x{h}": [synthetic_jpeg(w, h, seed=i)] for i, (w, h) in enumerate(synthetic_sizes)
+    }
+    for path in sample_images or []:
+        with open(path, "rb") as f:
+            data = f.read()
+        with Image.open(BytesIO(data)) as image:
+            images.setdefault("{}x{}".format(*image.size), []).append(data)
+
+    report = {
+        "backend": backend,
+        "mode": mode,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "images": sum(len(group) for group in images.values()),
+    }
+    if cold_load:
+        report.update(measure_cold_load(backend, mode, weights))
+    cv = load_model(backend, mode, weights)
+    report["stages"] = measure_stages(cv, images, repeats)
+    report["throughput"] = measure_throughput(
+        cv, next(iter(images.values()))[0], batch_sizes, threads, throughput_repeats
+    )
+    report["peak_rss_mb"] = _peak_rss_mb()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the musezen CV pipeline.")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--mode", choices=["fp32", "fast"], default="fp32")
+    parser.add_argument("--weights", default=None, help="Path to the model weights")
+    parser.add_argument("--images", nargs="*", default=[], help="Sample images to include")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--throughput-repeats", type=int, default=10)
+    parser.add_argument("--skip-cold-load", action="store_true")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Compare against this stored report")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed relative regression"
+    )
+    parser.add_argument(
+        "--noise-factor",
+        type=float,
+        default=NOISE_FACTOR,
+        help="Widen the tolerance to this many times the measured relative spread",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        backend=args.backend,
+        mode=args.mode,
+        weights=args.weights,
+        sample_images=args.images,
+        batch_sizes=args.batch_sizes,
+        threads=args.threads,
+        repeats=args.repeats,
+        throughput_repeats=args.throughput_repeats,
+        cold_load=not args.skip_cold_load,
+    )
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance, args.noise_factor)
+        if regressions:
+            print("Regressions against the baseline:")
+            print("\n".join(f"  {r}" for r in regressions))
+            sys.exit(1)
+        print("No regressions against the baseline")
@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
+
+from musezen.cv_components.musezen_cv_preprocessing import decode_image, to_array
+from musezen.cv_components.musezen_cv_similarity import bounded_map, iter_image_paths
+
+
+def iter_manifest(manifest_path: str):
+    """Yield the image paths listed in a manifest, one per line, skipping blanks and comments."""
+    with open(manifest_path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+def _load(path: str, normalize: bool):
+    """Decode and preprocess one image in a worker process. Errors are returned, not raised."""
+    try:
+        return path, to_array(decode_image(path), normalize), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+def _batched(iterable, batch_size: int):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+class JSONLWriter:
+    """Appends one JSON line per image; resumes by truncating to the last checkpointed offset."""
+
+    @staticmethod
+    def can_resume(path: str, checkpoint: dict) -> bool:
+        """Whether the output still holds everything written up to the checkpoint."""
+        return os.path.isfile(path) and os.path.getsize(path) >= checkpoint.get("output_bytes", 0)
+
+    def __init__(self, path: str, checkpoint: dict):
+        self.path = path
+        mode = "r+b" if checkpoint and os.path.exists(path) else "wb"
+        self._file = open(path, mode)
+        self._file.truncate(checkpoint.get("output_bytes", 0))
+        self._file.seek(0, os.SEEK_END)
+
+    def write(self, rows: list[dict]):
+        self._file.write("".join(json.dumps(row) + "\n" for row in rows).encode())
+
+    def flush(self) -> dict:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"output_bytes": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Writes a directory of Parquet part files, one per flush, so finished parts survive an
+    interruption; parts after the last checkpoint are removed on resume.
+    """
+
+    @staticmethod
+    def can_resume(path: str, checkpoint: dict) -> bool:
+        """Whether every part written up to the checkpoint is still there."""
+        return all(
+            os.path.isfile(os.path.join(path, f"part-{part:05d}.parquet"))
+            for part in range(checkpoint.get("parts", 0))
+        )
+
+    def __init__(self, path: str, checkpoint: dict):
+        import pyarrow
+        import pyarrow.parquet
+
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.parts = checkpoint.get("parts", 0)
+        os.makedirs(path, exist_ok=True)
+        for filename in os.listdir(path):
+            if filename.startswith("part-") and int(filename[5:10]) >= self.parts:
+                os.remove(os.path.join(path, filename))
+        self._rows = []
+
+    def write(self, rows: list[dict]):
+        self._rows.extend(rows)
+
+    def flush(self) -> dict:
+        if self._rows:
+            rows = [{**row, "scores": json.dumps(row["scores"])} for row in self._rows]
+            self._pq.write_table(
+                self._pa.Table.from_pylist(rows),
+                os.path.join(self.path, f"part-{self.parts:05d}.parquet"),
+            )
+            self.parts += 1
+            self._rows = []
+        return {"parts": self.parts}
+
+    def close(self):
+        self.flush()
+
+
+def classify_collection(
+    cv,
+    image_paths,
+    output_path: str,
+    output_format: str = "jsonl",
+    batch_size: int = 32,
+    num_workers: int = 4,
+    checkpoint_every: int = 20,
+    normalize: bool = True,
+    prefetch: int | None = None,
+):
+    """
+    Classify a whole collection and stream the results to disk, resuming from a checkpoint.
+
+    The checkpoint (`<output_path>.checkpoint`) records how many images of the (deterministic)
+    input order are safely written, and a hash of their paths. A rerun with the same inputs
+    skips those images; if the inputs or the output no longer match the checkpoint, the run
+    starts over.
+
+    Args:
+        cv (musezen_cv | musezen_cv_onnx): The classifier.
+        image_paths: An iterable of image paths, in a stable order.
+        output_path (str): JSONL file, or directory of Parquet parts.
+        output_format (str, optional): "jsonl" or "parquet". Defaults to "jsonl".
+        batch_size (int, optional): Images per forward pass. Defaults to 32.
+        num_workers (int, optional): Decoding processes. Defaults to 4.
+        checkpoint_every (int, optional): Batches between checkpoints. Defaults to 20.
+        normalize (bool, optional): Whether the model expects ImageNet-normalized inputs, False
+            for the fast mode with folded normalization. Defaults to True.
+        prefetch (int | None, optional): Images decoded ahead of the model. Every decoded image
+            is a 786 KB float32 array, so this bounds the memory when decoding outpaces
+            inference. Defaults to two batches.
+
+    Returns:
+        dict: The number of images processed in this run, failures, and images/sec.
+    """
+    checkpoint_path = output_path + ".checkpoint"
+    checkpoint = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    processed = checkpoint.get("processed", 0)
+    writer_cls = JSONLWriter if output_format == "jsonl" else ParquetWriter
+
+    # The paths already written must be the ones the checkpoint was taken on
+    image_paths = iter(image_paths)
+    done_paths = list(islice(image_paths, processed))
+    inputs_hash = hashlib.sha256()
+    for path in done_paths:
+        inputs_hash.update(path.encode() + b"\n")
+    if processed and (
+        len(done_paths) < processed
+        or inputs_hash.hexdigest() != checkpoint.get("inputs_sha256")
+        or not writer_cls.can_resume(output_path, checkpoint)
+    ):
+        print("Checkpoint does not match the inputs or the output, starting over")
+        checkpoint, processed, inputs_hash = {}, 0, hashlib.sha256()
+        remaining = chain(done_paths, image_paths)
+    else:
+        remaining = image_paths
+    writer = writer_cls(output_path, checkpoint)
+
+    def save_checkpoint():
+        state = {"processed": processed, "inputs_sha256": inputs_hash.hexdigest(), **writer.flush()}
+        with open(checkpoint_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+    if processed:
+        print(f"Resuming after {processed} images")
+    start, done, failed = time.perf_counter(), 0, 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(num_workers, mp_context=context) as pool:
+        loaded = bounded_map(
+            pool, partial(_load, normalize=normalize), remaining, prefetch or 2 * batch_size
+        )
+        for batch_number, batch in enumerate(_batched(loaded, batch_size), start=1):
+            ok = [(path, array) for path, array, error in batch if error is None]
+            predictions = iter(
+                cv.predict_with_scores(cv.collate([array for _, array in ok])) if ok else []
+            )
+            rows = []
+            for path, array, error in batch:
+                if error is None:
+                    rows.append({"path": path, **next(predictions), "error": None})
+                else:
+                    rows.append({"path": path, "style": None, "scores": None, "error": error})
+                    failed += 1
+            writer.write(rows)
+            for path, _, _ in batch:
+                inputs_hash.update(path.encode() + b"\n")
+            processed += len(batch)
+            done += len(batch)
+            if batch_number % checkpoint_every == 0:
+                save_checkpoint()
+                elapsed = time.perf_counter() - start
+                print(f"{processed} images, {done / elapsed:.1f} images/sec")
+    save_checkpoint()
+    writer.close()
+
+    elapsed = time.perf_counter() - start
+    return {
+        "processed": done,
+        "failed": failed,
+        "seconds": elapsed,
+        "images_per_sec": done / elapsed if elapsed else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Classify every image of a collection with the musezen style model."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--images", help="Directory to walk for images")
+    source.add_argument("--manifest", help="Text file with one image path per line")
+    parser.add_argument("--output", required=True, help="Output JSONL file or Parquet directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--mode", choices=["fp32", "fast"], default="fp32")
+    parser.add_argument("--weights", default=None, help="Path to the model weights")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--checkpoint-every", type=int, default=20)
+    args = parser.parse_args()
+
+    paths = iter_image_paths(args.images) if args.images else iter_manifest(args.manifest)
+    weights = {"model_weight_path": args.weights} if args.weights else {}
+    if args.backend == "onnx":
+        from musezen.cv_components.musezen_cv_onnx import musezen_cv_onnx
+
+        if args.weights:
+            weights["onnx_path"] = os.path.splitext(args.weights)[0] + ".onnx"
+        cv = musezen_cv_onnx(**weights)
+        normalize = True
+    else:
+        from musezen.cv_components.musezen_cv_foundation import musezen_cv
+
+        cv = musezen_cv(mode=args.mode, **weights)
+        normalize = cv.normalize_input
+
+    report = classify_collection(
+        cv,
+        paths,
+        args.output,
+        output_format=args.format,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        checkpoint_every=args.checkpoint_every,
+        normalize=normalize,
+    )
+    print(json.dumps(report))
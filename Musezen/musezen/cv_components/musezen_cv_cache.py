@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+
+def read_image_bytes(img_bytes) -> bytes:
+    """
+    Read the raw bytes of an image without consuming the caller's stream.
+
+    Args:
+        img_bytes: A path, raw bytes or file-like object (e.g. a Streamlit UploadedFile).
+
+    Returns:
+        bytes: The encoded image.
+    """
+    if isinstance(img_bytes, bytes):
+        return img_bytes
+    if hasattr(img_bytes, "getvalue"):
+        return img_bytes.getvalue()
+    if hasattr(img_bytes, "read"):
+        position = img_bytes.tell()
+        data = img_bytes.read()
+        img_bytes.seek(position)
+        return data
+    with open(img_bytes, "rb") as f:
+        return f.read()
+
+
+def dhash(data: bytes, hash_size: int = 8) -> int:
+    """
+    Compute the difference hash of an image.
+
+    The image is shrunk to a (hash_size + 1) x hash_size grayscale thumbnail and every bit records
+    whether a pixel is brighter than its right neighbour. Re-encoded, resized or slightly re-framed
+    photos of the same canvas end up within a few bits of each other.
+
+    Args:
+        data (bytes): The encoded image.
+        hash_size (int, optional): Side of the hash grid. Defaults to 8 (a 64-bit hash).
+
+    Returns:
+        int: The hash as an integer.
+    """
+    image = Image.open(BytesIO(data))
+    # Let the JPEG decoder downscale in the DCT domain, we only need a tiny thumbnail
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    image = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+class ImageResultCache:
+    """
+    A thread-safe LRU/TTL cache of classification results shared across sessions.
+
+    Lookups first try the SHA-256 of the encoded bytes, then fall back to the closest perceptual
+    hash within `max_distance` bits, so different phone shots of the same painting hit the cache.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float | None = 24 * 60 * 60,
+        max_distance: int = 6,
+    ):
+        """
+        Args:
+            max_size (int, optional): Maximum number of cached images. Defaults to 1024.
+            ttl (float | None, optional): Seconds an entry stays valid, None for no expiry.
+                Defaults to one day.
+            max_distance (int, optional): Maximum Hamming distance between perceptual hashes
+                to count as the same artwork. Set to -1 to only allow exact matches. Defaults to 6.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        # sha256 -> (perceptual hash, result, insertion time)
+        self._entries: OrderedDict[str, tuple[int, dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+
+    def keys(self, img_bytes) -> tuple[str, int]:
+        """
+        Compute the cache keys of an image.
+
+        Returns:
+            tuple[str, int]: The content hash and the perceptual hash.
+        """
+        data = read_image_bytes(img_bytes)
+        return hashlib.sha256(data).hexdigest(), dhash(data)
+
+    def _expired(self, inserted_at: float, now: float) -> bool:
+        return self.ttl is not None and now - inserted_at > self.ttl
+
+    def get(self, keys: tuple[str, int]) -> dict | None:
+        """
+        Look up a cached result.
+
+        Args:
+            keys (tuple[str, int]): The keys returned by `keys`.
+
+        Returns:
+            dict | None: The cached result, or None on a miss.
+        """
+        digest, phash = keys
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and not self._expired(entry[2], now):
+                self._entries.move_to_end(digest)
+                self.exact_hits += 1
+                return entry[1]
+
+            best_digest, best_distance = None, self.max_distance + 1
+            for other_digest, (other_phash, _, inserted_at) in self._entries.items():
+                if self._expired(inserted_at, now):
+                    continue
+                distance = (phash ^ other_phash).bit_count()
+                if distance < best_distance:
+                    best_digest, best_distance = other_digest, distance
+            if best_digest is not None:
+                self._entries.move_to_end(best_digest)
+                self.perceptual_hits += 1
+                return self._entries[best_digest][1]
+
+            self.misses += 1
+            return None
+
+    def put(self, keys: tuple[str, int], result: dict):
+        """Store a result, evicting expired entries first and then the least recently used ones."""
+        digest, phash = keys
+        now = time.monotonic()
+        with self._lock:
+            self._entries[digest] = (phash, result, now)
+            self._entries.move_to_end(digest)
+            for other_digest in [
+                d for d, (_, _, t) in self._entries.items() if self._expired(t, now)
+            ]:
+                del self._entries[other_digest]
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Return the hit/miss counters and the overall hit rate."""
+        with self._lock:
+            lookups = self.exact_hits + self.perceptual_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "perceptual_hits": self.perceptual_hits,
+                "misses": self.misses,
+                "hit_rate": (
+                    (self.exact_hits + self.perceptual_hits) / lookups if lookups else 0.0
+                ),
+            }
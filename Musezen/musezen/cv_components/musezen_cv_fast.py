@@ -0,0 +1,172 @@
+import random
+
+import torch
+import torch.nn as nn
+import torch.ao.quantization as quantization
+from torchvision import transforms
+from torchvision.models.quantization import resnet50 as quantizable_resnet50
+
+from musezen.cv_components.musezen_cv_foundation import musezen_cv
+from musezen.cv_components.musezen_cv_preprocessing import (
+    IMAGENET_MEAN,
+    IMAGENET_STD,
+    MIN_SAMPLE_IMAGES,
+    SAMPLE_IMAGES_ENV,
+    decode_image,
+    find_sample_images,
+    to_array,
+)
+
+
+def fold_normalize_into_conv(conv: nn.Conv2d, mean: list[float], std: list[float]):
+    """
+    Fold `transforms.Normalize(mean, std)` into the first convolution so the model takes [0, 1]
+    pixels directly and preprocessing can skip normalization.
+
+    conv((x - mean) / std) = conv'(x) with w' = w / std and b' = b - sum(w * mean / std). The only
+    difference is at the zero-padded border, where the folded conv sees 0 instead of -mean / std;
+    the agreement check in `optimize_for_cpu` guards against that changing predictions.
+    """
+    mean = torch.tensor(mean).view(1, -1, 1, 1)
+    std = torch.tensor(std).view(1, -1, 1, 1)
+    with torch.no_grad():
+        weight = conv.weight / std
+        bias = -(weight * mean).sum(dim=(1, 2, 3))
+        if conv.bias is not None:
+            bias += conv.bias
+        conv.weight.copy_(weight)
+        conv.bias = nn.Parameter(bias, requires_grad=False)
+
+
+def _static_quantize(
+    model: nn.Module, calibration: torch.Tensor, fold_normalize: bool
+) -> nn.Module:
+    """Rebuild the model as torchvision's quantizable ResNet-50 and calibrate INT8 observers."""
+    quantized = quantizable_resnet50(weights=None, quantize=False)
+    quantized.fc = nn.Linear(quantized.fc.in_features, model.fc.out_features)
+    quantized.load_state_dict(model.state_dict())
+    quantized.eval()
+    if fold_normalize:
+        fold_normalize_into_conv(quantized.conv1, IMAGENET_MEAN, IMAGENET_STD)
+    quantized.fuse_model()
+    quantized.qconfig = quantization.get_default_qconfig(
+        torch.backends.quantized.engine
+    )
+    quantization.prepare(quantized, inplace=True)
+    with torch.inference_mode():
+        quantized(calibration)
+    return quantization.convert(quantized, inplace=True)
+
+
+def split_samples(sample_images: list, holdout: float = 0.5, seed: int = 0) -> tuple:
+    """Shuffle the samples reproducibly into (calibration, held-out) images."""
+    shuffled = list(sample_images)
+    random.Random(seed).shuffle(shuffled)
+    num_held_out = max(int(len(shuffled) * holdout), 1)
+    return shuffled[num_held_out:], shuffled[:num_held_out]
+
+
+def _load_samples(images: list) -> torch.Tensor:
+    """Decode images into an un-normalized [0, 1] batch."""
+    return torch.stack(
+        [torch.from_numpy(to_array(decode_image(image), normalize=False)) for image in images]
+    )
+
+
+def top1_agreement(reference: list[str], candidate: list[str]) -> float:
+    """Share of images on which two classifiers predict the same style."""
+    return sum(r == c for r, c in zip(reference, candidate)) / len(reference)
+
+
+def optimize_for_cpu(
+    cv: musezen_cv,
+    sample_images: list | None = None,
+    quantize: str | None = "static",
+    channels_last: bool = True,
+    fold_normalize: bool = True,
+    freeze: str | None = "trace",
+    min_agreement: float = 0.95,
+    holdout: float = 0.5,
+) -> float:
+    """
+    Switch a loaded fp32 `musezen_cv` to the fast CPU inference mode in place.
+
+    Args:
+        cv (musezen_cv): The classifier to optimize.
+        sample_images (list | None, optional): Real paintings (paths or file-like objects), at
+            least MIN_SAMPLE_IMAGES. Part of them calibrates the quantization, the held-out rest
+            checks the agreement with the fp32 model. Defaults to None, the images of the
+            MUSEZEN_CV_SAMPLES directory.
+        quantize (str | None, optional): "static" for INT8 weights and activations, "dynamic" for
+            INT8 weights of the `fc` head only, or None. Defaults to "static".
+        channels_last (bool, optional): Use the NHWC memory format. Defaults to True.
+        fold_normalize (bool, optional): Fold the `Normalize` step into the first conv. Defaults
+            to True.
+        freeze (str | None, optional): "trace" for a frozen TorchScript graph, "compile" for
+            `torch.compile`, or None. Defaults to "trace".
+        min_agreement (float, optional): Minimum top-1 agreement with the fp32 model on the
+            held-out samples. Defaults to 0.95.
+        holdout (float, optional): Share of the samples held out for the agreement check.
+            Defaults to 0.5.
+
+    Returns:
+        float: The measured top-1 agreement.
+
+    Raises:
+        ValueError: If there are fewer than MIN_SAMPLE_IMAGES sample images, or if the optimized
+            model agrees with the fp32 model on less than `min_agreement` of the held-out
+            samples. `cv` is left unchanged in that case.
+    """
+    normalize = transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+
+    sample_images = sample_images or find_sample_images()
+    if len(sample_images) < MIN_SAMPLE_IMAGES:
+        # Synthetic images say nothing about the accuracy on real paintings
+        raise ValueError(
+            f"The fast mode needs at least {MIN_SAMPLE_IMAGES} real sample images, set "
+            f"{SAMPLE_IMAGES_ENV} to a directory of paintings (found {len(sample_images)})"
+        )
+    calibration_images, held_out_images = split_samples(sample_images, holdout)
+    raw_held_out = _load_samples(held_out_images)
+    reference = cv.predict(normalize(raw_held_out))
+
+    if quantize == "static":
+        calibration = _load_samples(calibration_images)
+        if not fold_normalize:
+            calibration = normalize(calibration)
+        model = _static_quantize(cv.model, calibration, fold_normalize)
+    else:
+        model = musezen_cv.build_model(cv.model.fc.out_features)
+        model.load_state_dict(cv.model.state_dict())
+        model.eval()
+        if fold_normalize:
+            fold_normalize_into_conv(model.conv1, IMAGENET_MEAN, IMAGENET_STD)
+        if quantize == "dynamic":
+            model = quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    model.requires_grad_(False)
+
+    memory_format = torch.contiguous_format
+    if channels_last:
+        memory_format = torch.channels_last
+        model = model.to(memory_format=memory_format)
+
+    candidate_inputs = raw_held_out if fold_normalize else normalize(raw_held_out)
+    candidate_inputs = candidate_inputs.contiguous(memory_format=memory_format)
+    with torch.inference_mode():
+        if freeze == "trace":
+            model = torch.jit.freeze(torch.jit.trace(model, candidate_inputs[:1]))
+        elif freeze == "compile":
+            model = torch.compile(model)
+        _, predicted = torch.max(model(candidate_inputs), 1)
+    candidate = [cv.idx_to_class[int(idx)] for idx in predicted]
+
+    agreement = top1_agreement(reference, candidate)
+    if agreement < min_agreement:
+        raise ValueError(
+            f"Fast mode top-1 agreement with fp32 is {agreement:.2%}, below {min_agreement:.2%}"
+        )
+
+    cv.model = model
+    cv.memory_format = memory_format
+    cv.normalize_input = not fold_normalize
+    return agreement
@@ -7,13 +7,23 @@ Original file is located at
     https://colab.research.google.com/drive/17i7imITXVc0GnuVUuA7XW-reEfbVHMiZ
 """
 
-import torchvision.models as models
-from torchvision import transforms
-import torch.nn as nn
 import os
-import torch
-from PIL import Image
-from io import BytesIO
+import threading
+from typing import TYPE_CHECKING
+
+from musezen.cv_components.musezen_cv_preprocessing import (
+    MIN_SAMPLE_IMAGES,
+    SAMPLE_IMAGES_ENV,
+    decode_image,
+    find_sample_images,
+    to_array,
+)
+
+# torch and torchvision take seconds to import, so they are only imported when the model is
+# first loaded; the annotations below only need them for type checkers
+if TYPE_CHECKING:
+    import torch
+    import torch.nn as nn
 
 
 class musezen_cv:
@@ -22,12 +32,42 @@ class musezen_cv:
         model_weight_path=os.path.join(
             "Musezen", "musezen", "cv_components", "model_weights_freezed.pt"
         ),
+        warmup: bool = True,
+        mode: str = "fp32",
+        sample_images: list | None = None,
+        lazy: bool = False,
+        background_warmup: bool = False,
     ):
-        self.model = models.resnet50(pretrained=False)
-        num_features = self.model.fc.in_features
-        self.model.fc = nn.Linear(num_features, 27)
-        state_dict = torch.load(model_weight_path)
-        self.model.load_state_dict(state_dict)
+        """
+        Load the fine-tuned ResNet-50 style classifier.
+
+        The instance is read-only once loaded, so a single one can be shared by every session in
+        the process (see `get_cv_model` in musezen_chat.py).
+
+        Args:
+            model_weight_path (str): Path to the fine-tuned state dict.
+            warmup (bool, optional): Run one dummy forward pass so the first real request does not
+                pay for lazy allocations. Defaults to True.
+            mode (str, optional): "fp32" for the stock model or "fast" for the quantized,
+                channels_last CPU mode (see `musezen_cv_fast.optimize_for_cpu`). Defaults to "fp32".
+            sample_images (list | None, optional): Real paintings used by the "fast" mode to
+                calibrate and to check agreement with the fp32 model. Defaults to None, the
+                images of the MUSEZEN_CV_SAMPLES directory.
+            lazy (bool, optional): Defer importing torch and loading the weights until the first
+                classification. Defaults to False.
+            background_warmup (bool, optional): Load and warm up the model on a background thread
+                so construction returns immediately; callers block only if they classify before it
+                finishes. Defaults to False.
+        """
+        self.model_weight_path = model_weight_path
+        self.mode = mode
+        self.sample_images = sample_images
+        self.warmup_on_load = warmup
+        self.model = None
+        self.memory_format = None
+        self._loaded = threading.Event()
+        self._load_lock = threading.Lock()
+        self._loader = None
         self.idx_to_class = {
             0: "Abstract_Expressionism",
             1: "Action_painting",
@@ -58,22 +98,219 @@ class musezen_cv:
             26: "Ukiyo_e",
         }
 
-        self.transform = transforms.Compose(
-            [
-                transforms.Resize((256, 256)),
-                transforms.ToTensor(),
-                transforms.Normalize(
-                    mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
-                ),
-            ]
-        )
+        # Cleared by the fast mode once Normalize is folded into the first conv
+        self.normalize_input = True
+        if mode not in ("fp32", "fast"):
+            raise ValueError(f"Unknown inference mode: {mode}")
+        if mode == "fast":
+            # Refuse early rather than on the background loading thread
+            self.sample_images = sample_images or find_sample_images()
+            if len(self.sample_images) < MIN_SAMPLE_IMAGES:
+                raise ValueError(
+                    f"The fast mode needs at least {MIN_SAMPLE_IMAGES} real sample images, set "
+                    f"{SAMPLE_IMAGES_ENV} to a directory of paintings"
+                )
+
+        if background_warmup:
+            threading.Thread(
+                target=self.load, name="musezen-cv-warmup", daemon=True
+            ).start()
+        elif not lazy:
+            self.load()
+
+    def load(self):
+        """
+        Import torch, load the weights and warm up the model if that has not happened yet.
+
+        Every inference method calls this first. Concurrent callers block until the one thread doing
+        the work is done, and if loading failed the next caller retries and sees the error.
+        """
+        # The fast mode runs predictions on the model while it is being loaded
+        if self._loaded.is_set() or self._loader == threading.get_ident():
+            return
+        with self._load_lock:
+            if self._loaded.is_set():
+                return
+            self._loader = threading.get_ident()
+            try:
+                self._load()
+            finally:
+                self._loader = None
+            self._loaded.set()
+
+    def is_ready(self) -> bool:
+        """Whether the model is loaded and warmed up, e.g. for readiness probes."""
+        return self._loaded.is_set()
+
+    def _load(self):
+        import torch
+
+        # Build the module on the meta device so no memory is allocated or randomly initialized,
+        # then adopt the memory-mapped weight tensors directly
+        with torch.device("meta"):
+            model = self.build_model(len(self.idx_to_class))
+        model.load_state_dict(self._load_state_dict(), assign=True)
+        # The model is never trained here, freeze it once instead of on every call
+        model.eval()
+        model.requires_grad_(False)
+        self.model = model
+        self.memory_format = torch.contiguous_format
+
+        if self.mode == "fast":
+            from musezen.cv_components.musezen_cv_fast import optimize_for_cpu
+
+            optimize_for_cpu(self, sample_images=self.sample_images)
+
+        if self.warmup_on_load:
+            self.warmup()
+
+    def _load_state_dict(self) -> dict:
+        import torch
+
+        try:
+            return torch.load(
+                self.model_weight_path, map_location="cpu", mmap=True, weights_only=True
+            )
+        except RuntimeError:
+            # Checkpoints saved in the legacy (non-zip) format cannot be memory-mapped
+            return torch.load(self.model_weight_path, map_location="cpu", weights_only=True)
+
+    def warmup(self):
+        """Run a dummy forward pass to initialize kernels and allocator pools."""
+        import torch
+
+        with torch.inference_mode():
+            self.model(
+                torch.zeros(1, 3, 256, 256).contiguous(memory_format=self.memory_format)
+            )
+
+    @staticmethod
+    def build_model(num_classes: int) -> "nn.Module":
+        """Create an untrained ResNet-50 with a `num_classes`-way `fc` head."""
+        import torch.nn as nn
+        import torchvision.models as models
+
+        model = models.resnet50(weights=None)
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+        return model
+
+    def preprocess(self, img_bytes) -> "torch.Tensor":
+        """
+        Decode an image and turn it into a normalized (3, 256, 256) tensor.
+
+        See `musezen_cv_preprocessing` for the reduced-resolution decode.
+
+        Args:
+            img_bytes: A path or file-like object holding the image.
+
+        Returns:
+            torch.Tensor: The model input for a single image (without the batch dimension).
+        """
+        import torch
+
+        # The fast mode changes normalize_input, so loading has to finish first
+        self.load()
+        return torch.from_numpy(to_array(decode_image(img_bytes), self.normalize_input))
+
+    def collate(self, img_tensors: list) -> "torch.Tensor":
+        """Stack preprocessed images (tensors or NumPy arrays) into a batch."""
+        import torch
+
+        return torch.stack([torch.as_tensor(t) for t in img_tensors])
+
+    def predict(self, img_tensors: "torch.Tensor") -> list[str]:
+        """
+        Run the classifier on an already preprocessed batch.
+
+        Args:
+            img_tensors (torch.Tensor): A (N, 3, 256, 256) batch from `preprocess`.
+
+        Returns:
+            list[str]: The predicted style for each image, in input order.
+        """
+        import torch
+
+        self.load()
+        with torch.inference_mode():
+            output = self.model(img_tensors.contiguous(memory_format=self.memory_format))
+            _, predicted = torch.max(output, 1)
+        return [self.idx_to_class[int(idx)] for idx in predicted]
+
+    def predict_with_scores(self, img_tensors: "torch.Tensor") -> list[dict]:
+        """
+        Run the classifier on an already preprocessed batch and keep the class probabilities.
+
+        Args:
+            img_tensors (torch.Tensor): A (N, 3, 256, 256) batch from `preprocess`.
+
+        Returns:
+            list[dict]: For each image, a dictionary with:
+                - style: The predicted style.
+                - scores: The softmax probability of every style.
+        """
+        import torch
+
+        self.load()
+        with torch.inference_mode():
+            output = self.model(img_tensors.contiguous(memory_format=self.memory_format))
+            probabilities = torch.softmax(output, dim=1)
+        results = []
+        for probs in probabilities.tolist():
+            scores = {self.idx_to_class[i]: p for i, p in enumerate(probs)}
+            results.append({"style": max(scores, key=scores.get), "scores": scores})
+        return results
+
+    def classify_batch(self, images: list) -> list[str]:
+        """
+        Classify several images with a single forward pass.
+
+        Args:
+            images (list): Paths or file-like objects holding the images.
+
+        Returns:
+            list[str]: The predicted style for each image, in input order.
+        """
+        if not images:
+            return []
+        img_tensors = self.collate([self.preprocess(image) for image in images])
+        return self.predict(img_tensors)
 
     def classify(self, img_bytes):
-        image = Image.open(img_bytes).convert("RGB")
-        img_tensor = self.transform(image)
-        img_tensor = img_tensor.unsqueeze(0)
-        self.model.eval()
-        output = self.model(img_tensor)
-        _, predicted = torch.max(output, 1)
-        classified = self.idx_to_class[int(predicted)]
-        return classified
+        return self.classify_batch([img_bytes])[0]
+
+    def embed_tensors(self, img_tensors: "torch.Tensor") -> "torch.Tensor":
+        """
+        Compute the 2048-d penultimate ResNet-50 features of a preprocessed batch, i.e. the input
+        of the `fc` head, L2-normalized so dot products are cosine similarities.
+
+        Only available with the fp32 model, the fast mode does not keep the intermediate layers.
+        """
+        import torch
+        import torchvision.models as models
+
+        self.load()
+        model = self.model
+        if not isinstance(model, models.ResNet):
+            raise ValueError("Embeddings are only available in the fp32 inference mode")
+        with torch.inference_mode():
+            x = img_tensors.contiguous(memory_format=self.memory_format)
+            x = model.maxpool(model.relu(model.bn1(model.conv1(x))))
+            x = model.layer4(model.layer3(model.layer2(model.layer1(x))))
+            features = torch.flatten(model.avgpool(x), 1)
+            return torch.nn.functional.normalize(features, dim=1)
+
+    def embed(self, images: list) -> "torch.Tensor":
+        """
+        Embed several images for similarity search.
+
+        Args:
+            images (list): Paths or file-like objects holding the images.
+
+        Returns:
+            torch.Tensor: A (N, 2048) batch of L2-normalized embeddings, in input order.
+        """
+        if not images:
+            import torch
+
+            return torch.empty(0, 2048)
+        return self.embed_tensors(self.collate([self.preprocess(image) for image in images]))
@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+from musezen.cv_components.musezen_cv_preprocessing import decode_image, to_array
+
+IDX_TO_CLASS_KEY = "idx_to_class"
+
+
+def export_onnx(model_weight_path: str, onnx_path: str, opset_version: int = 17):
+    """
+    Export the fine-tuned ResNet-50 and its `idx_to_class` map to an ONNX artifact.
+
+    This is the only part of the ONNX backend that needs torch, and it only runs once per
+    artifact.
+
+    Args:
+        model_weight_path (str): Path to the fine-tuned state dict.
+        onnx_path (str): Where to write the ONNX graph.
+        opset_version (int, optional): The ONNX opset to target. Defaults to 17.
+    """
+    import onnx
+    import torch
+
+    from musezen.cv_components.musezen_cv_foundation import musezen_cv
+
+    cv = musezen_cv(model_weight_path, warmup=False)
+    torch.onnx.export(
+        cv.model,
+        torch.zeros(1, 3, 256, 256),
+        onnx_path,
+        input_names=["image"],
+        output_names=["logits"],
+        dynamic_axes={"image": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset_version,
+        dynamo=False,
+    )
+    graph = onnx.load(onnx_path)
+    onnx.helper.set_model_props(graph, {IDX_TO_CLASS_KEY: json.dumps(cv.idx_to_class)})
+    onnx.save(graph, onnx_path)
+
+
+class musezen_cv_onnx:
+    """
+    The style classifier served through ONNX Runtime's CPU execution provider.
+
+    Exposes the same `preprocess`/`collate`/`predict`/`predict_with_scores`/`classify_batch`/
+    `classify` interface as `musezen_cv`, without importing torch or torchvision.
+    """
+
+    def __init__(
+        self,
+        onnx_path=os.path.join(
+            "Musezen", "musezen", "cv_components", "model_weights_freezed.onnx"
+        ),
+        model_weight_path=os.path.join(
+            "Musezen", "musezen", "cv_components", "model_weights_freezed.pt"
+        ),
+        intra_op_num_threads: int | None = None,
+        inter_op_num_threads: int = 1,
+        warmup: bool = True,
+    ):
+        """
+        Load the ONNX artifact, exporting it from the torch weights first if it does not exist.
+
+        Args:
+            onnx_path (str): Path to the exported ONNX graph.
+            model_weight_path (str): Path to the fine-tuned state dict, only used for the export.
+            intra_op_num_threads (int | None, optional): Threads used inside one operator.
+                Defaults to None, one per physical core.
+            inter_op_num_threads (int, optional): Threads used across independent operators.
+                ResNet-50 is a single chain, so more than 1 only adds overhead. Defaults to 1.
+            warmup (bool, optional): Run one dummy inference after loading. Defaults to True.
+        """
+        if not os.path.exists(onnx_path):
+            export_onnx(model_weight_path, onnx_path)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = inter_op_num_threads
+        if intra_op_num_threads is not None:
+            options.intra_op_num_threads = intra_op_num_threads
+        self.session = ort.InferenceSession(
+            onnx_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.idx_to_class = {
+            int(idx): name for idx, name in json.loads(metadata[IDX_TO_CLASS_KEY]).items()
+        }
+
+        if warmup:
+            self.predict(np.zeros((1, 3, 256, 256), dtype=np.float32))
+
+    def preprocess(self, img_bytes) -> np.ndarray:
+        """Decode an image and turn it into a normalized (3, 256, 256) float32 array."""
+        return to_array(decode_image(img_bytes))
+
+    def collate(self, img_arrays: list[np.ndarray]) -> np.ndarray:
+        """Stack preprocessed images into a batch."""
+        return np.stack(img_arrays)
+
+    def _logits(self, img_arrays: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: img_arrays})[0]
+
+    def predict(self, img_arrays: np.ndarray) -> list[str]:
+        """Run the classifier on an already preprocessed (N, 3, 256, 256) batch."""
+        return [self.idx_to_class[int(idx)] for idx in self._logits(img_arrays).argmax(1)]
+
+    def predict_with_scores(self, img_arrays: np.ndarray) -> list[dict]:
+        """
+        Run the classifier on an already preprocessed batch and keep the class probabilities.
+
+        Returns:
+            list[dict]: For each image, the predicted `style` and the `scores` of every style.
+        """
+        logits = self._logits(img_arrays)
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities = exp / exp.sum(axis=1, keepdims=True)
+        results = []
+        for probs in probabilities.tolist():
+            scores = {self.idx_to_class[i]: p for i, p in enumerate(probs)}
+            results.append({"style": max(scores, key=scores.get), "scores": scores})
+        return results
+
+    def classify_batch(self, images: list) -> list[str]:
+        """Classify several images with a single inference call."""
+        if not images:
+            return []
+        return self.predict(self.collate([self.preprocess(image) for image in images]))
+
+    def classify(self, img_bytes):
+        return self.classify_batch([img_bytes])[0]
@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# (x / 255 - mean) / std == (x - 255 * mean) * (1 / (255 * std)), so uint8 pixels can be
+# normalized with one subtraction and one multiplication on a single float buffer
+_OFFSET = (np.array(IMAGENET_MEAN, dtype=np.float32) * 255).reshape(3, 1, 1)
+_SCALE = (1 / (np.array(IMAGENET_STD, dtype=np.float32) * 255)).reshape(3, 1, 1)
+
+# Directory of real paintings used to calibrate the fast mode and check its agreement with fp32
+SAMPLE_IMAGES_ENV = "MUSEZEN_CV_SAMPLES"
+SAMPLE_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+# Calibration and held-out images each need enough paintings for the agreement to mean anything
+MIN_SAMPLE_IMAGES = 16
+
+
+def decode_image(img_bytes, size: tuple[int, int] = (256, 256)) -> Image.Image:
+    """
+    Decode an upload straight to a small RGB image.
+
+    JPEGs are decoded in draft mode, which lets libjpeg downscale by up to 8x in the DCT domain so
+    a 48 MP photo is never materialized at full resolution. Other formats use PIL's reducing gap
+    to shrink by an integer factor before the final resize. The EXIF orientation is applied so
+    portrait phone shots are classified upright.
+
+    Args:
+        img_bytes: A path or file-like object holding the image.
+        size (tuple[int, int], optional): The output (width, height). Defaults to (256, 256).
+
+    Returns:
+        Image.Image: The RGB image at exactly `size`.
+    """
+    image = Image.open(img_bytes)
+    # draft keeps both sides at or above the requested size, and only ever reduces
+    image.draft("RGB", size)
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image.resize(size, Image.BILINEAR, reducing_gap=3.0)
+
+
+def to_array(image: Image.Image, normalize: bool = True) -> np.ndarray:
+    """
+    Convert an RGB image into a (3, H, W) float32 array.
+
+    The uint8 pixels are converted into a single float32 CHW buffer, and scaling/normalization
+    then happen in place on that buffer.
+
+    Args:
+        image (Image.Image): The decoded image.
+        normalize (bool, optional): Apply the ImageNet mean/std normalization. When False the
+            values are only scaled to [0, 1], for models with normalization folded into the first
+            conv. Defaults to True.
+
+    Returns:
+        np.ndarray: The model input for a single image.
+    """
+    pixels = np.asarray(image).transpose(2, 0, 1).astype(np.float32, order="C")
+    if normalize:
+        pixels -= _OFFSET
+        pixels *= _SCALE
+    else:
+        pixels *= 1 / 255
+    return pixels
+
+
+def find_sample_images(path: str | None = None) -> list[str]:
+    """
+    List the sample paintings of the fast mode.
+
+    Args:
+        path (str | None, optional): A directory of images. Defaults to the MUSEZEN_CV_SAMPLES
+            environment variable.
+
+    Returns:
+        list[str]: The image paths, sorted, empty if the directory is not set or missing.
+    """
+    path = path or os.environ.get(SAMPLE_IMAGES_ENV)
+    if not path or not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.join(path, name)
+        for name in os.listdir(path)
+        if name.lower().endswith(SAMPLE_IMAGE_EXTENSIONS)
+    )
+
+
+def _legacy_preprocess(path: str) -> np.ndarray:
+    """The original full-resolution decode path, kept for benchmarking."""
+    from torchvision import transforms
+
+    transform = transforms.Compose(
+        [
+            transforms.Resize((256, 256)),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+        ]
+    )
+    return transform(Image.open(path).convert("RGB")).numpy()
+
+
+def _fast_preprocess(path: str) -> np.ndarray:
+    return to_array(decode_image(path))
+
+
+_PATHS = {"legacy": _legacy_preprocess, "fast": _fast_preprocess}
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the kernel's peak RSS counter (VmHWM) of this process, Linux only."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _measure_peak_memory(name: str, path: str) -> float:
+    """
+    Peak RSS growth in MB of one preprocessing run in this process. Without a resettable
+    counter, only growth above the peak reached by the imports is visible.
+    """
+    if name == "legacy":
+        # Imports are not part of the request
+        from torchvision import transforms  # noqa: F401
+    if _reset_peak_rss():
+        with open("/proc/self/statm") as f:
+            before = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    else:
+        before = _peak_rss_kb()
+    _PATHS[name](path)
+    return max(_peak_rss_kb() - before, 0) / 1024
+
+
+def measure_peak_memory(name: str, path: str) -> float:
+    """Peak RSS growth in MB of one preprocessing run, in a fresh interpreter."""
+    code = (
+        "import json; from musezen.cv_components.musezen_cv_preprocessing import "
+        f"_measure_peak_memory; print(json.dumps(_measure_peak_memory({name!r}, {path!r})))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def benchmark(path: str, repeats: int = 10) -> dict:
+    """
+    Compare the legacy and the fast decode+preprocess paths on one image.
+
+    Peak memory is the growth of the resident set size during a single run, measured in a fresh
+    interpreter per path so neither inherits the other's allocator pools.
+
+    Args:
+        path (str): The image to preprocess.
+        repeats (int, optional): Number of timed runs per path. Defaults to 10.
+
+    Returns:
+        dict: Mean latency in milliseconds and peak memory in MB for both paths.
+    """
+    report = {}
+    for name, fn in _PATHS.items():
+        fn(path)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(path)
+        report[f"{name}_ms"] = (time.perf_counter() - start) / repeats * 1000
+        report[f"{name}_peak_mb"] = measure_peak_memory(name, path)
+    report["speedup"] = report["legacy_ms"] / report["fast_ms"]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fast decode+preprocess path against the legacy one."
+    )
+    parser.add_argument("images", nargs="+", help="Images to preprocess")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+    for path in args.images:
+        print(path, benchmark(path, args.repeats))
@@ -0,0 +1,312 @@
+import argparse
+import json
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff")
+
+logger = logging.getLogger(__name__)
+
+
+def iter_image_paths(root: str):
+    """Yield the image files under `root` in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, filename)
+
+
+def _batched(iterable, batch_size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bounded_map(pool, fn, iterable, prefetch: int):
+    """Like `pool.map`, but keeps at most `prefetch` results in flight instead of submitting all."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Normalize along the last axis, leaving zero vectors at zero instead of NaN."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _spherical_kmeans(
+    vectors: np.ndarray, n_clusters: int, n_iter: int = 20, seed: int = 0
+) -> np.ndarray:
+    """Cluster L2-normalized vectors by cosine similarity and return normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        # Re-seed empty clusters with random points instead of leaving them dead
+        empty = ~sums.any(axis=1)
+        sums[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+        centroids = _l2_normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class ArtworkIndex:
+    """
+    A memory-mapped IVF (inverted file) index of artwork embeddings.
+
+    Embeddings are PCA-projected, L2-normalized and stored as float16, grouped by their nearest
+    k-means centroid. A query only scans the `n_probe` closest lists, and because the vectors are
+    memory-mapped only those lists are paged in, so the index works for collections much larger
+    than RAM.
+
+    Files in `index_dir`:
+        - meta.json: Dimensions and list count.
+        - pca_mean.npy / pca_components.npy: The projection from 2048-d features.
+        - centroids.npy: One centroid per list.
+        - offsets.npy: Start of each list in `vectors.f16`/`ids.i64`.
+        - vectors.f16 / ids.i64: The projected embeddings and their item ids, sorted by list.
+        - items.txt / item_offsets.i64: One item label per line and the byte offset of each line.
+    """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        count, dim = self.meta["count"], self.meta["dim"]
+        self.pca_mean = np.load(os.path.join(index_dir, "pca_mean.npy"))
+        self.pca_components = np.load(os.path.join(index_dir, "pca_components.npy"))
+        self.centroids = np.load(os.path.join(index_dir, "centroids.npy"))
+        self.offsets = np.load(os.path.join(index_dir, "offsets.npy"))
+        self.vectors = np.memmap(
+            os.path.join(index_dir, "vectors.f16"), np.float16, "r", shape=(count, dim)
+        )
+        self.ids = np.memmap(os.path.join(index_dir, "ids.i64"), np.int64, "r", shape=(count,))
+        self.item_offsets = np.memmap(
+            os.path.join(index_dir, "item_offsets.i64"), np.int64, "r", shape=(count + 1,)
+        )
+        self._items = np.memmap(os.path.join(index_dir, "items.txt"), np.uint8, "r")
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def project(self, embeddings: np.ndarray) -> np.ndarray:
+        """Map 2048-d embeddings into the normalized index space."""
+        projected = (np.asarray(embeddings, dtype=np.float32) - self.pca_mean) @ (
+            self.pca_components.T
+        )
+        return _l2_normalize(projected)
+
+    def item(self, item_id: int) -> str:
+        """Return the label (usually the image path) of an item."""
+        start, end = self.item_offsets[item_id], self.item_offsets[item_id + 1]
+        return bytes(self._items[start:end]).decode()[:-1]
+
+    def search(
+        self, embeddings: np.ndarray, k: int = 5, n_probe: int = 8
+    ) -> list[list[tuple[str, float]]]:
+        """
+        Find the most similar artworks.
+
+        Args:
+            embeddings (np.ndarray): A (Q, 2048) batch of embeddings from `musezen_cv.embed`.
+            k (int, optional): Number of neighbours per query. Defaults to 5.
+            n_probe (int, optional): Number of lists to scan per query. Higher is more accurate
+                and slower. Defaults to 8.
+
+        Returns:
+            list[list[tuple[str, float]]]: For each query, (item label, cosine similarity) pairs
+                from most to least similar.
+        """
+        queries = self.project(np.atleast_2d(embeddings))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+        results = []
+        for query, lists in zip(queries, probes):
+            ids, scores = [], []
+            for list_id in lists:
+                start, end = self.offsets[list_id], self.offsets[list_id + 1]
+                if start == end:
+                    continue
+                scores.append(self.vectors[start:end].astype(np.float32) @ query)
+                ids.append(self.ids[start:end])
+            if not scores:
+                results.append([])
+                continue
+            scores, ids = np.concatenate(scores), np.concatenate(ids)
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            results.append([(self.item(int(ids[i])), float(scores[i])) for i in top])
+        return results
+
+
+def build_index(
+    cv,
+    image_paths,
+    index_dir: str,
+    dim: int = 256,
+    n_lists: int | None = None,
+    train_size: int = 50_000,
+    batch_size: int = 32,
+    num_workers: int = 4,
+    chunk_size: int = 65_536,
+) -> ArtworkIndex:
+    """
+    Embed a reference collection and build an `ArtworkIndex` from it.
+
+    Every stage streams through memory-mapped files, so only one batch of images and one chunk
+    of embeddings are held in RAM at a time.
+
+    Args:
+        cv (musezen_cv): The fp32 classifier used to embed the images.
+        image_paths: An iterable of image paths, used as item labels.
+        index_dir (str): Where to write the index.
+        dim (int, optional): Dimensions kept by the PCA projection. Defaults to 256.
+        n_lists (int | None, optional): Number of IVF lists. Defaults to 4 * sqrt(count).
+        train_size (int, optional): Embeddings sampled to fit the PCA and k-means. Defaults
+            to 50,000.
+        batch_size (int, optional): Images per forward pass. Defaults to 32.
+        num_workers (int, optional): Threads decoding images. Defaults to 4.
+        chunk_size (int, optional): Embeddings processed at once after embedding. Defaults
+            to 65,536.
+
+    Returns:
+        ArtworkIndex: The freshly built index.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    features_path = os.path.join(index_dir, "features.f32")
+
+    # 1. Embed every image, appending raw features and labels to disk
+    count = 0
+    items_size = 0
+    with (
+        open(features_path, "wb") as features,
+        open(os.path.join(index_dir, "items.txt"), "wb") as items,
+        open(os.path.join(index_dir, "item_offsets.i64"), "wb") as item_offsets,
+        ThreadPoolExecutor(num_workers) as pool,
+    ):
+        item_offsets.write(np.int64(0).tobytes())
+
+        def load(path):
+            try:
+                return path, cv.preprocess(path)
+            except Exception as e:
+                logger.warning("Skipping %s: %s", path, e)
+                return path, None
+
+        loaded = bounded_map(pool, load, image_paths, prefetch=2 * batch_size)
+        for batch in _batched(loaded, batch_size):
+            batch = [(path, tensor) for path, tensor in batch if tensor is not None]
+            if not batch:
+                continue
+            embeddings = cv.embed_tensors(cv.collate([tensor for _, tensor in batch]))
+            features.write(embeddings.numpy().astype(np.float32).tobytes())
+            for path, _ in batch:
+                line = (path.replace("\n", " ") + "\n").encode()
+                items.write(line)
+                items_size += len(line)
+                item_offsets.write(np.int64(items_size).tobytes())
+            count += len(batch)
+    if count == 0:
+        raise ValueError("No images could be embedded")
+    features = np.memmap(features_path, np.float32, "r").reshape(count, -1)
+    dim = min(dim, features.shape[1], count)
+
+    # 2. Fit the PCA projection and the coarse quantizer on a sample
+    rng = np.random.default_rng(0)
+    sample = features[np.sort(rng.choice(count, min(train_size, count), replace=False))]
+    # A single embedding centered on itself projects to zero, keep its direction instead
+    pca_mean = sample.mean(axis=0) if len(sample) > 1 else np.zeros_like(sample[0])
+    _, _, vt = np.linalg.svd(sample - pca_mean, full_matrices=False)
+    pca_components = vt[:dim].astype(np.float32)
+    projected_sample = _l2_normalize((sample - pca_mean) @ pca_components.T)
+    n_lists = n_lists or max(1, int(4 * np.sqrt(count)))
+    n_lists = min(n_lists, len(projected_sample))
+    centroids = _spherical_kmeans(projected_sample, n_lists)
+
+    # 3. Project and assign everything, then write the vectors grouped by list
+    projected_path = os.path.join(index_dir, "projected.f16")
+    projected = np.memmap(projected_path, np.float16, "w+", shape=(count, dim))
+    assignments = np.empty(count, dtype=np.int32)
+    for start in range(0, count, chunk_size):
+        chunk = _l2_normalize((features[start : start + chunk_size] - pca_mean) @ pca_components.T)
+        projected[start : start + chunk_size] = chunk
+        assignments[start : start + chunk_size] = (chunk @ centroids.T).argmax(axis=1)
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignments, minlength=n_lists))
+
+    vectors = np.memmap(
+        os.path.join(index_dir, "vectors.f16"), np.float16, "w+", shape=(count, dim)
+    )
+    for start in range(0, count, chunk_size):
+        vectors[start : start + chunk_size] = projected[order[start : start + chunk_size]]
+    vectors.flush()
+    order.astype(np.int64).tofile(os.path.join(index_dir, "ids.i64"))
+    del projected, vectors, features
+    os.remove(projected_path)
+    os.remove(features_path)
+
+    np.save(os.path.join(index_dir, "pca_mean.npy"), pca_mean.astype(np.float32))
+    np.save(os.path.join(index_dir, "pca_components.npy"), pca_components)
+    np.save(os.path.join(index_dir, "centroids.npy"), centroids)
+    np.save(os.path.join(index_dir, "offsets.npy"), offsets)
+    with open(os.path.join(index_dir, "meta.json"), "w") as f:
+        json.dump({"count": count, "dim": dim, "n_lists": n_lists}, f)
+    return ArtworkIndex(index_dir)
+
+
+if __name__ == "__main__":
+    from musezen.cv_components.musezen_cv_foundation import musezen_cv
+
+    parser = argparse.ArgumentParser(description="Build or query a similar-artworks index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Embed a collection directory")
+    build_parser.add_argument("images", help="Directory of reference artwork images")
+    build_parser.add_argument("index_dir", help="Where to write the index")
+    build_parser.add_argument("--weights", default=None, help="Path to the model weights")
+    build_parser.add_argument("--dim", type=int, default=256)
+    build_parser.add_argument("--n-lists", type=int, default=None)
+    build_parser.add_argument("--batch-size", type=int, default=32)
+    build_parser.add_argument("--num-workers", type=int, default=4)
+    query_parser = subparsers.add_parser("query", help="Find artworks similar to images")
+    query_parser.add_argument("index_dir")
+    query_parser.add_argument("images", nargs="+")
+    query_parser.add_argument("--weights", default=None, help="Path to the model weights")
+    query_parser.add_argument("-k", type=int, default=5)
+    query_parser.add_argument("--n-probe", type=int, default=8)
+    args = parser.parse_args()
+
+    cv = musezen_cv(args.weights) if args.weights else musezen_cv()
+    if args.command == "build":
+        index = build_index(
+            cv,
+            iter_image_paths(args.images),
+            args.index_dir,
+            dim=args.dim,
+            n_lists=args.n_lists,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+        )
+        print(f"Indexed {len(index)} images into {index.meta['n_lists']} lists")
+    else:
+        index = ArtworkIndex(args.index_dir)
+        for path, matches in zip(
+            args.images, index.search(cv.embed(args.images).numpy(), args.k, args.n_probe)
+        ):
+            print(path)
+            for label, score in matches:
+                print(f"  {score:.3f}  {label}")
@@ -1,91 +1,320 @@
 import requests
 import json
+import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from musezen.external_integrations.ArtsyCache import ResponseCache
+from musezen.external_integrations.ArtsyRateLimit import RateLimiter
+
+# Refresh the XAPP token this many seconds before Artsy says it expires
+TOKEN_REFRESH_MARGIN = 300
+DEFAULT_CACHE_PATH = "artsy_cache.sqlite"
+DEFAULT_RATE_LIMIT_PATH = "artsy_rate_limit.sqlite"
+# Requests per second and burst size shared by every process using the same limiter file
+DEFAULT_RATE_LIMIT = 5.0
+DEFAULT_RATE_BURST = 10.0
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+_clients = {}
+_caches = {}
+_limiters = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(client_id, client_secret, cache_path=None, rate_limit_path=None):
+    """
+    Return the process-wide ArtsyAPI client for these credentials, creating it on first use.
+
+    Sharing one client lets every tool call reuse its keep-alive connections, XAPP token and
+    response cache.
+
+    Args:
+        client_id (str): The Artsy client ID.
+        client_secret (str): The Artsy client secret.
+        cache_path (str, optional): SQLite file of the persistent response cache. Defaults to
+            the ARTSY_CACHE_PATH environment variable, or artsy_cache.sqlite. An empty string
+            disables caching.
+        rate_limit_path (str, optional): SQLite file of the token bucket shared with the other
+            processes. Defaults to the ARTSY_RATE_LIMIT_PATH environment variable, or
+            artsy_rate_limit.sqlite. An empty string disables rate limiting. The rate and burst
+            come from ARTSY_RATE_LIMIT and ARTSY_RATE_BURST.
+    """
+    if cache_path is None:
+        cache_path = os.environ.get("ARTSY_CACHE_PATH", DEFAULT_CACHE_PATH)
+    if rate_limit_path is None:
+        rate_limit_path = os.environ.get("ARTSY_RATE_LIMIT_PATH", DEFAULT_RATE_LIMIT_PATH)
+    key = (client_id, client_secret, cache_path, rate_limit_path)
+    with _clients_lock:
+        if key not in _clients:
+            if cache_path and cache_path not in _caches:
+                _caches[cache_path] = ResponseCache(cache_path)
+            if rate_limit_path and rate_limit_path not in _limiters:
+                _limiters[rate_limit_path] = RateLimiter(
+                    rate_limit_path,
+                    rate=float(os.environ.get("ARTSY_RATE_LIMIT", DEFAULT_RATE_LIMIT)),
+                    capacity=float(os.environ.get("ARTSY_RATE_BURST", DEFAULT_RATE_BURST)),
+                )
+            _clients[key] = ArtsyAPI(
+                client_id,
+                client_secret,
+                cache=_caches.get(cache_path),
+                rate_limiter=_limiters.get(rate_limit_path),
+            )
+        return _clients[key]
+
+
+def retry_after_seconds(response) -> float | None:
+    """Parse a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
 
 
 class ArtsyAPI:
-    def __init__(self, client_id, client_secret):
+    def __init__(
+        self,
+        client_id,
+        client_secret,
+        pool_maxsize=16,
+        cache=None,
+        rate_limiter=None,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_max=30.0,
+    ):
         self.base_url = "https://api.artsy.net/api"
         self.client_id = client_id
         self.client_secret = client_secret
         self.session = requests.Session()
-        self.token = self._get_token()
-        self.session.headers.update({"X-Xapp-Token": self.token})
+        # Keep enough pooled keep-alive connections for concurrent sessions
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.token = None
+        self.token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self.cache: ResponseCache | None = cache
+        self.rate_limiter: RateLimiter | None = rate_limiter
+        # Retries of 429 and transient 5xx responses, with jittered exponential backoff
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
 
     def _get_token(self):
-        """Retrieve the XAPP token needed for authentication."""
+        """Retrieve the XAPP token needed for authentication, along with its expiry time."""
         url = f"{self.base_url}/tokens/xapp_token"
         params = {"client_id": self.client_id, "client_secret": self.client_secret}
         response = self.session.post(url, params=params)
         response.raise_for_status()  # Raise an error on bad status
-        return response.json()["token"]
+        data = response.json()
+        expires_at = data.get("expires_at")
+        if expires_at:
+            expires_at = datetime.fromisoformat(expires_at.replace("Z", "+00:00")).timestamp()
+        else:
+            # Artsy tokens last about a week, assume a day if the expiry is missing
+            expires_at = time.time() + 24 * 60 * 60
+        return data["token"], expires_at
+
+    def _ensure_token(self, stale_token=None):
+        """
+        Return a valid XAPP token, fetching a new one if the cached one is about to expire or was
+        rejected (`stale_token`). Concurrent callers wait for a single refresh.
+        """
+        if self._token_is_fresh(stale_token):
+            return self.token
+        with self._token_lock:
+            # Another thread may have refreshed it while we were waiting
+            if self._token_is_fresh(stale_token):
+                return self.token
+            self.token, self.token_expires_at = self._get_token()
+            return self.token
+
+    def _token_is_fresh(self, stale_token=None):
+        return (
+            self.token is not None
+            and self.token != stale_token
+            and time.time() < self.token_expires_at - TOKEN_REFRESH_MARGIN
+        )
+
+    def _get(self, url, params=None):
+        """Authenticated GET, served from the response cache when one is configured."""
+        if self.cache is None:
+            return self._fetch(url, params)
+        return self.cache.get_or_fetch(
+            self.cache.key(url, params), lambda: self._fetch(url, params)
+        )
+
+    def _fetch(self, url, params=None):
+        """Authenticated GET that refreshes the token and retries once if it was rejected."""
+        token = self._ensure_token()
+        response = self._send(url, params, token)
+        if response.status_code == 401:
+            token = self._ensure_token(stale_token=token)
+            response = self._send(url, params, token)
+        response.raise_for_status()
+        return response.json()
+
+    def _send(self, url, params, token):
+        """
+        Rate-limited GET that backs off and retries on 429 and transient 5xx responses.
+
+        A 429 pauses the shared limiter for the Retry-After duration, so every process slows
+        down instead of each one discovering the throttling on its own.
+        """
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = self.session.get(url, params=params, headers={"X-Xapp-Token": token})
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                return response
+            delay = retry_after_seconds(response)
+            if delay is None:
+                # Full jitter keeps concurrent clients from retrying in lockstep
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff_base * 2**attempt)
+                )
+            if response.status_code == 429 and self.rate_limiter is not None:
+                self.rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            self.retries += 1
+        return response
+
+    def stats(self) -> dict:
+        """Return the rate limiter's queueing metrics and the number of retried requests."""
+        metrics = {"retries": self.retries}
+        if self.rate_limiter is not None:
+            metrics.update(self.rate_limiter.stats())
+        return metrics
 
     def _make_request(self, endpoint, params=None):
         """General method to make authenticated requests to the API."""
 
         url = f"{self.base_url}/{endpoint}"
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
-        return response.json()
+        return self._get(url, params=params)
 
     def fetch_link(self, link):
         """Given a complete API link, fetch the data from the link."""
-        response = self.session.get(link)
-        response.raise_for_status()
-        return response.json()
+        return self._get(link)
 
-    def search(self, query, page_size=10, offset=0):
+    def search(self, query, page_size=10, offset=0, type_filter=None):
         """Search the Artsy database for any query term using optional type filtering."""
         params = {"q": query, "size": page_size, "offset": offset}
+        if type_filter:
+            # Let Artsy filter server-side so the first page is usually enough
+            params["type"] = type_filter
         return self._make_request("search", params=params)
 
+    def _iter_pages(
+        self,
+        query: str,
+        type_filter: str | None = None,
+        page_size: int = 10,
+        max_pages: int = 5,
+        concurrency: int = 1,
+    ):
+        """
+        Yield search result pages in order, stopping after the last page or `max_pages`.
+
+        With `concurrency` > 1, windows of that many pages are requested in parallel, pacing is
+        left to the shared rate limiter. Pages are only requested when the consumer asks for
+        them, so closing the generator early saves round-trips.
+        """
+        if concurrency <= 1:
+            for page in range(max_pages):
+                response = self.search(query, page_size, page * page_size, type_filter)
+                yield response
+                if "next" not in response.get("_links", {}):
+                    return
+            return
+
+        pool = ThreadPoolExecutor(concurrency, "artsy-pagination")
+        try:
+            for window_start in range(0, max_pages, concurrency):
+                futures = [
+                    pool.submit(self.search, query, page_size, page * page_size, type_filter)
+                    for page in range(window_start, min(window_start + concurrency, max_pages))
+                ]
+                for future in futures:
+                    response = future.result()
+                    yield response
+                    if "next" not in response.get("_links", {}):
+                        return
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def iter_results(
+        self,
+        query: str,
+        type_filter: str | None = None,
+        max_results: int = 10,
+        max_pages: int = 5,
+        concurrency: int = 1,
+    ):
+        """
+        Lazily yield search results matching `type_filter`, stopping as soon as `max_results`
+        matches were found instead of walking every page.
+        """
+        found = 0
+        for response in self._iter_pages(
+            query, type_filter, max_pages=max_pages, concurrency=concurrency
+        ):
+            for result in response.get("_embedded", {}).get("results", []):
+                if type_filter and result.get("type") != type_filter:
+                    continue
+                yield result
+                found += 1
+                if found >= max_results:
+                    return
+
     def fetch_all_results(
         self,
         query: str,
         type_filter: str | None = None,
         max_results: int = 10,
         max_pages: int = 5,
+        concurrency: int = 1,
     ):
         """Fetch all results for a query, handling pagination, while maintaining the original response structure."""
         full_results = []
-        page_size = 10
-        offset = 0
-        # Flag to capture the initial response structure
-        initial = True
+        # The first page provides the envelope (_links, total_count, ...) of the response
         final_response = {}
 
-        while True:
-            response = self.search(query, page_size, offset)
-
-            if initial:
-                # Capture the initial structure of the response
+        pages = self._iter_pages(
+            query, type_filter, max_pages=max_pages, concurrency=concurrency
+        )
+        for response in pages:
+            if not final_response:
                 final_response = response
-                initial = False
-
-            if "_embedded" in response and "results" in response["_embedded"]:
-                # Filter results by type if type_filter is specified
-                current_results = response["_embedded"]["results"]
-                # Checking in loop since we have to throttle the requests anyways
-                if type_filter:
-                    current_results = [
-                        r for r in current_results if r.get("type") == type_filter
-                    ]
-                full_results.extend(current_results)
-
-            # If enough results are fetched or looked through first 5 pages, break the loop
-            if (len(full_results) >= max_results) or (offset / page_size >= max_pages):
-                break
 
-            # Update offset based on response details
-            if "next" in response.get("_links", {}):
-                offset += page_size
-            else:
-                break
+            current_results = response.get("_embedded", {}).get("results", [])
+            if type_filter:
+                current_results = [
+                    r for r in current_results if r.get("type") == type_filter
+                ]
+            full_results.extend(current_results)
 
-            # Throttle the requests to manage API rate limits
-            time.sleep(0.2)
+            # Stop requesting pages once enough results are fetched
+            if len(full_results) >= max_results:
+                pages.close()
+                break
 
         # Update the final response with all accumulated results
+        full_results = full_results[:max_results]
         if "_embedded" in final_response:
             final_response["_embedded"]["results"] = full_results
         else:
@@ -93,6 +322,20 @@ class ArtsyAPI:
 
         return final_response
 
+    def iter_collection(self, endpoint, params=None, max_pages=None):
+        """
+        Yield the embedded records of a paginated collection (e.g. "genes", "artists") page by
+        page, following the `next` links. Bypasses the response cache, since it is used to
+        refresh the local catalog mirror.
+        """
+        url, page = f"{self.base_url}/{endpoint}", 0
+        while url and (max_pages is None or page < max_pages):
+            response = self._fetch(url, params)
+            yield response.get("_embedded", {}).get(endpoint, [])
+            # The next link already carries the cursor and the original parameters
+            url, params = response.get("_links", {}).get("next", {}).get("href"), None
+            page += 1
+
     def get_artists(self, **params):
         """
         An artist is generally one person, but can also be two people collaborating, a collective of people, or even a mysterious entity such as "Banksy".
@@ -0,0 +1,229 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# (fresh seconds, stale seconds) per endpoint. A fresh entry is returned as is, a stale one is
+# returned immediately while a background refresh replaces it, anything older is refetched.
+DEFAULT_TTLS = {
+    "genes": (7 * 24 * 60 * 60, 30 * 24 * 60 * 60),
+    "artists": (24 * 60 * 60, 7 * 24 * 60 * 60),
+    "artworks": (24 * 60 * 60, 7 * 24 * 60 * 60),
+    "search": (60 * 60, 24 * 60 * 60),
+}
+DEFAULT_TTL = (60 * 60, 24 * 60 * 60)
+
+
+class ResponseCache:
+    """
+    A two-tier cache of Artsy API responses: an in-memory LRU in front of a SQLite table.
+
+    The SQLite tier persists across restarts, so a freshly deployed pod starts warm instead of
+    stampeding Artsy. Entries are keyed by endpoint path plus canonicalized query parameters.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        memory_max_entries: int = 512,
+        disk_max_entries: int = 50_000,
+        ttls: dict = DEFAULT_TTLS,
+        default_ttl: tuple = DEFAULT_TTL,
+        refresh_workers: int = 2,
+    ):
+        """
+        Args:
+            path (str): The SQLite database file.
+            memory_max_entries (int, optional): Size of the in-memory LRU. Defaults to 512.
+            disk_max_entries (int, optional): Rows kept in SQLite before the least recently used
+                ones are evicted. Defaults to 50,000.
+            ttls (dict, optional): (fresh, stale) seconds per endpoint, keyed by the first path
+                segment after /api/. Defaults to DEFAULT_TTLS.
+            default_ttl (tuple, optional): (fresh, stale) seconds for other endpoints.
+            refresh_workers (int, optional): Threads running stale-while-revalidate refreshes.
+                Defaults to 2.
+        """
+        self.path = path
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._refreshing = set()
+        self._refresher = ThreadPoolExecutor(refresh_workers, "artsy-cache-refresh")
+        self._puts = 0
+        self.metrics = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stale_hits": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "evictions": 0,
+        }
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One SQLite connection per thread, in WAL mode so readers never block the writer."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(url: str, params: dict | None = None) -> str:
+        """Canonical cache key: the URL path plus sorted query parameters from both sources."""
+        parts = urlsplit(url)
+        query = parse_qsl(parts.query) + [
+            (k, str(v)) for k, v in (params or {}).items() if v is not None
+        ]
+        path = parts.path.split("/api/", 1)[-1].strip("/")
+        return f"{path}?{urlencode(sorted(query))}" if query else path
+
+    def ttl(self, key: str) -> tuple:
+        return self.ttls.get(key.split("/", 1)[0].split("?", 1)[0], self.default_ttl)
+
+    def _state(self, key: str, stored_at: float) -> str | None:
+        fresh, stale = self.ttl(key)
+        age = time.time() - stored_at
+        if age < fresh:
+            return "fresh"
+        if age < stale:
+            return "stale"
+        return None
+
+    def get(self, key: str) -> tuple:
+        """
+        Look up a response.
+
+        Returns:
+            tuple: (value, state) where state is "fresh", "stale" or None on a miss.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                state = self._state(key, entry[1])
+                if state:
+                    self._memory.move_to_end(key)
+                    self.metrics["memory_hits"] += 1
+                    # Entries are kept as JSON text so callers can never mutate the cached copy
+                    return json.loads(entry[0]), state
+                del self._memory[key]
+
+        row = (
+            self._connection()
+            .execute("SELECT value, stored_at FROM responses WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if row is not None:
+            state = self._state(key, row[1])
+            if state:
+                self._connection().execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                )
+                with self._lock:
+                    self._remember(key, row[0], row[1])
+                    self.metrics["disk_hits"] += 1
+                return json.loads(row[0]), state
+
+        with self._lock:
+            self.metrics["misses"] += 1
+        return None, None
+
+    def _remember(self, key: str, text: str, stored_at: float):
+        """Insert serialized JSON into the memory tier. Must hold self._lock."""
+        self._memory[key] = (text, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, value):
+        """Store a response in both tiers."""
+        now = time.time()
+        text = json.dumps(value)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO responses (key, value, stored_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (key, text, now, now),
+        )
+        with self._lock:
+            self._remember(key, text, now)
+            self._puts += 1
+            evict = self._puts % 100 == 0
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        """Trim the SQLite tier to disk_max_entries, dropping the least recently used rows."""
+        deleted = (
+            self._connection()
+            .execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_max_entries,),
+            )
+            .rowcount
+        )
+        with self._lock:
+            self.metrics["evictions"] += max(deleted, 0)
+
+    def get_or_fetch(self, key: str, fetch):
+        """
+        Return the cached response for `key`, calling `fetch()` on a miss. Stale entries are
+        returned immediately and refreshed in the background, at most once at a time per key.
+        """
+        value, state = self.get(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            with self._lock:
+                self.metrics["stale_hits"] += 1
+                if key in self._refreshing:
+                    return value
+                self._refreshing.add(key)
+            self._refresher.submit(self._refresh, key, fetch)
+            return value
+        value = fetch()
+        self.put(key, value)
+        return value
+
+    def _refresh(self, key: str, fetch):
+        try:
+            self.put(key, fetch())
+            with self._lock:
+                self.metrics["refreshes"] += 1
+        except Exception:
+            # Keep serving the stale entry, the next stale hit will try again
+            with self._lock:
+                self.metrics["refresh_errors"] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self) -> dict:
+        """Return the hit/miss metrics, hit rate and tier sizes."""
+        with self._lock:
+            metrics = dict(self.metrics)
+            metrics["memory_entries"] = len(self._memory)
+        metrics["disk_entries"] = (
+            self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        )
+        hits = metrics["memory_hits"] + metrics["disk_hits"]
+        lookups = hits + metrics["misses"]
+        metrics["hit_rate"] = hits / lookups if lookups else 0.0
+        return metrics
@@ -0,0 +1,388 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+DEFAULT_CATALOG_PATH = "artsy_catalog.sqlite"
+# Stored in the database's user_version, bumped when `normalize` changes so the stored names
+# are normalized again
+NORMALIZE_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(path=None):
+    """
+    Return the process-wide catalog mirror, or None if it has not been synced yet.
+
+    Args:
+        path (str, optional): SQLite file of the mirror. Defaults to the ARTSY_CATALOG_PATH
+            environment variable, or artsy_catalog.sqlite.
+    """
+    if path is None:
+        path = os.environ.get("ARTSY_CATALOG_PATH", DEFAULT_CATALOG_PATH)
+    if not path or not os.path.exists(path):
+        return None
+    with _catalogs_lock:
+        if path not in _catalogs:
+            _catalogs[path] = ArtsyCatalog(path)
+        return _catalogs[path]
+
+
+def normalize(text: str) -> str:
+    """
+    Casefold, strip accents of Latin letters and collapse punctuation, so "Pop-Art" and "pop
+    art" match. Letters of every script are kept, "草間彌生" and "Айвазовский" stay distinct.
+    """
+    chars = []
+    for c in unicodedata.normalize("NFKC", text).casefold():
+        # Only Latin letters lose their accents, a kana's dakuten or a Cyrillic breve is part of
+        # the letter
+        base = unicodedata.normalize("NFKD", c)[0]
+        c = base if base.isascii() else c
+        chars.append(c if unicodedata.category(c)[0] in "LNM" else " ")
+    return " ".join("".join(chars).split())
+
+
+def trigrams(text: str) -> set[str]:
+    """Character trigrams of a normalized name, padded so word boundaries count too."""
+    text = f" {text} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class _TrigramIndex:
+    """In-memory posting lists from trigram to entity, rebuilt when the mirror changes."""
+
+    def __init__(self, rows: list[tuple], version: int):
+        self.version = version
+        self.rows = rows
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for position, (_, _, normalized) in enumerate(rows):
+            grams = trigrams(normalized)
+            self.sizes.append(len(grams))
+            for trigram in grams:
+                self.postings[trigram].append(position)
+
+    def search(self, text: str, limit: int) -> list[tuple]:
+        """
+        The entities sharing the most trigrams with `text`, as (row, Dice similarity) pairs.
+        """
+        grams = trigrams(text)
+        counts = Counter()
+        for trigram in grams:
+            counts.update(self.postings.get(trigram, ()))
+        return [
+            (self.rows[position], 2 * shared / (len(grams) + self.sizes[position]))
+            for position, shared in counts.most_common(limit)
+        ]
+
+
+class ArtsyCatalog:
+    """
+    A local mirror of the Artsy gene and artist catalogs with a fuzzy name resolver.
+
+    Entities are stored in SQLite as the raw API records, indexed by normalized name and slug.
+    Fuzzy lookups go through trigram posting lists kept in memory: an FTS5 trigram table needs
+    a ranked OR query for typo tolerance, which takes milliseconds on a large artist catalog.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): The SQLite database file.
+        """
+        self.path = path
+        self._local = threading.local()
+        self._indexes = {}
+        self._index_lock = threading.Lock()
+        connection = self._connection()
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entities (
+                kind TEXT NOT NULL, id TEXT NOT NULL, slug TEXT, name TEXT NOT NULL,
+                normalized TEXT NOT NULL, data TEXT NOT NULL, synced_at REAL NOT NULL,
+                PRIMARY KEY (kind, id));
+            CREATE INDEX IF NOT EXISTS entities_normalized ON entities (kind, normalized);
+            CREATE INDEX IF NOT EXISTS entities_slug ON entities (kind, slug);
+            CREATE TABLE IF NOT EXISTS sync_state (
+                key TEXT PRIMARY KEY, synced_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS versions (
+                kind TEXT PRIMARY KEY, version INTEGER NOT NULL);
+            """
+        )
+        if connection.execute("PRAGMA user_version").fetchone()[0] < NORMALIZE_VERSION:
+            self._renormalize(connection)
+
+    def _renormalize(self, connection: sqlite3.Connection):
+        """Normalize the stored names again after `normalize` changed."""
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            rows = connection.execute("SELECT kind, id, name FROM entities").fetchall()
+            connection.executemany(
+                "UPDATE entities SET normalized = ? WHERE kind = ? AND id = ?",
+                [(normalize(name), kind, id) for kind, id, name in rows],
+            )
+            # The in-memory indexes of other processes hold the old names
+            connection.execute("UPDATE versions SET version = version + 1")
+            connection.execute(f"PRAGMA user_version = {NORMALIZE_VERSION}")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _connection(self) -> sqlite3.Connection:
+        """One SQLite connection per thread, in WAL mode so readers never block the writer."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def upsert(self, kind: str, records: list[dict]):
+        """Insert or update API records of a kind ("genes" or "artists") in one transaction."""
+        now = time.time()
+        rows = [
+            (
+                kind,
+                record["id"],
+                record.get("slug"),
+                record["name"],
+                normalize(record["name"]),
+                json.dumps(record),
+                now,
+            )
+            for record in records
+            if record.get("id") and record.get("name")
+        ]
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            known = {}
+            # SQLite limits the number of bound parameters of a statement
+            for start in range(0, len(rows), 500):
+                ids = [row[1] for row in rows[start : start + 500]]
+                known.update(
+                    connection.execute(
+                        f"SELECT id, name FROM entities WHERE kind = ? AND id IN "
+                        f"({', '.join('?' * len(ids))})",
+                        (kind, *ids),
+                    ).fetchall()
+                )
+            connection.executemany(
+                "INSERT INTO entities VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (kind, id) DO UPDATE SET slug = excluded.slug, name = excluded.name, "
+                "normalized = excluded.normalized, data = excluded.data, "
+                "synced_at = excluded.synced_at",
+                rows,
+            )
+            # Bumped when the indexed names change so the in-memory indexes of all processes
+            # rebuild; refreshing the data of known entities keeps them
+            if any(known.get(row[1]) != row[3] for row in rows):
+                connection.execute(
+                    "INSERT INTO versions VALUES (?, 1) "
+                    "ON CONFLICT (kind) DO UPDATE SET version = version + 1",
+                    (kind,),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _index(self, kind: str) -> _TrigramIndex:
+        row = (
+            self._connection()
+            .execute("SELECT version FROM versions WHERE kind = ?", (kind,))
+            .fetchone()
+        )
+        version = row[0] if row else 0
+        with self._index_lock:
+            index = self._indexes.get(kind)
+            if index is None or index.version != version:
+                rows = (
+                    self._connection()
+                    .execute(
+                        "SELECT id, name, normalized FROM entities WHERE kind = ?", (kind,)
+                    )
+                    .fetchall()
+                )
+                index = self._indexes[kind] = _TrigramIndex(rows, version)
+            return index
+
+    def get(self, kind: str, entity_id: str) -> dict | None:
+        """Return the stored API record of an entity by ID or slug."""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT data FROM entities WHERE kind = ? AND (id = ? OR slug = ?)",
+                (kind, entity_id, entity_id),
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def resolve(
+        self, query: str, kind: str, limit: int = 5, min_score: float = 0.7
+    ) -> list[dict]:
+        """
+        Map a free-text query to the best matching entities.
+
+        Exact name and slug matches win outright. Otherwise names are scored by the Dice
+        similarity of their trigrams with the query, which tolerates typos ("impresionism"),
+        with a floor for whole words and prefixes ("warhol").
+
+        Returns:
+            list[dict]: Up to `limit` matches with their `id`, `name` and `score` in [0, 1].
+        """
+        text = normalize(query)
+        if not text:
+            return []
+        connection = self._connection()
+        for column, value in (("normalized", text), ("slug", text.replace(" ", "-"))):
+            rows = connection.execute(
+                f"SELECT id, name FROM entities WHERE kind = ? AND {column} = ? LIMIT ?",
+                (kind, value, limit),
+            ).fetchall()
+            if rows:
+                return [{"id": id, "name": name, "score": 1.0} for id, name in rows]
+
+        matches = []
+        for (id, name, normalized), score in self._index(kind).search(text, 50):
+            if text in normalized.split() or normalized.startswith(text):
+                # Surnames and prefixes are how people usually refer to an artist
+                score = max(score, 0.85)
+            if score >= min_score:
+                matches.append({"id": id, "name": name, "score": score})
+        matches.sort(key=lambda m: m["score"], reverse=True)
+        return matches[:limit]
+
+    def synced_at(self, key: str) -> float:
+        row = (
+            self._connection()
+            .execute("SELECT synced_at FROM sync_state WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row else 0.0
+
+    def mark_synced(self, key: str):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, time.time())
+        )
+
+    def stats(self) -> dict:
+        """Return the number of mirrored entities per kind."""
+        return dict(
+            self._connection()
+            .execute("SELECT kind, COUNT(*) FROM entities GROUP BY kind")
+            .fetchall()
+        )
+
+
+def sync_catalog(
+    client,
+    catalog: ArtsyCatalog,
+    max_age: float = 24 * 60 * 60,
+    max_genes: int | None = None,
+    page_size: int = 100,
+):
+    """
+    Incrementally mirror the Artsy catalogs: the full gene list, then the artists of the genes
+    whose artists were synced longest ago (or never), skipping anything newer than `max_age`.
+
+    Running it periodically with a small `max_genes` spreads the artist crawl over several runs
+    instead of hitting the API with the whole catalog at once.
+
+    Args:
+        client (ArtsyAPI): The API client.
+        catalog (ArtsyCatalog): The mirror to update.
+        max_age (float, optional): Seconds before an entry is synced again. Defaults to a day.
+        max_genes (int | None, optional): Genes whose artists are synced in this run. Defaults
+            to None, all of them.
+        page_size (int, optional): Records per API page. Defaults to 100.
+
+    Returns:
+        dict: The number of genes and artists synced in this run, and of failed requests. A
+            failure is logged as a warning and skipped, so a periodic sync keeps going.
+    """
+    synced = {"genes": 0, "artists": 0, "errors": 0}
+    if time.time() - catalog.synced_at("genes") > max_age:
+        try:
+            for page in client.iter_collection("genes", {"size": page_size}):
+                catalog.upsert("genes", page)
+                synced["genes"] += len(page)
+            catalog.mark_synced("genes")
+        except Exception as e:
+            # The pages written so far are kept, the gene list is synced again on the next run
+            logger.warning("Syncing the genes failed: %s: %s", type(e).__name__, e)
+            synced["errors"] += 1
+
+    gene_ids = [
+        row[0]
+        for row in catalog._connection()
+        .execute(
+            "SELECT e.id FROM entities e LEFT JOIN sync_state s "
+            "ON s.key = 'artists:' || e.id WHERE e.kind = 'genes' "
+            "AND COALESCE(s.synced_at, 0) < ? ORDER BY COALESCE(s.synced_at, 0)",
+            (time.time() - max_age,),
+        )
+        .fetchall()
+    ]
+    for gene_id in gene_ids[:max_genes]:
+        try:
+            for page in client.iter_collection(
+                "artists", {"gene_id": gene_id, "size": page_size}
+            ):
+                catalog.upsert("artists", page)
+                synced["artists"] += len(page)
+            catalog.mark_synced(f"artists:{gene_id}")
+        except Exception as e:
+            # One failing gene must not stop the others, it stays first in line for the next run
+            logger.warning(
+                "Syncing the artists of gene %s failed: %s: %s", gene_id, type(e).__name__, e
+            )
+            synced["errors"] += 1
+    return synced
+
+
+if __name__ == "__main__":
+    from musezen.external_integrations.ArtsyAPI import get_client
+
+    parser = argparse.ArgumentParser(description="Mirror the Artsy gene and artist catalogs.")
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG_PATH)
+    parser.add_argument("--max-age-hours", type=float, default=24)
+    parser.add_argument("--max-genes", type=int, default=None)
+    parser.add_argument(
+        "--interval-minutes",
+        type=float,
+        default=None,
+        help="Keep running and refresh at this interval",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    client = get_client(os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET"))
+    catalog = ArtsyCatalog(args.catalog)
+    while True:
+        try:
+            synced = sync_catalog(
+                client, catalog, max_age=args.max_age_hours * 60 * 60, max_genes=args.max_genes
+            )
+            print(json.dumps({"synced": synced, "catalog": catalog.stats()}))
+        except Exception as e:
+            # e.g. the token request failing, retry at the next interval
+            logger.exception("Sync failed")
+            if args.interval_minutes is None:
+                raise
+        if args.interval_minutes is None:
+            break
+        time.sleep(args.interval_minutes * 60)
@@ -0,0 +1,118 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    A token bucket shared by every thread and process that points at the same SQLite file.
+
+    Each `acquire()` reserves a token in one short write transaction and sleeps until its turn,
+    so callers are served in arrival order without polling. A 429 from Artsy pauses the whole
+    bucket through `pause()`, which every other process sees on its next reservation.
+    """
+
+    def __init__(self, path: str, rate: float = 5.0, capacity: float = 10.0):
+        """
+        Args:
+            path (str): The SQLite database file holding the bucket state.
+            rate (float, optional): Tokens, i.e. requests, added per second. Defaults to 5.
+            capacity (float, optional): Maximum burst size. Defaults to 10.
+        """
+        self.path = path
+        self.rate = rate
+        self.capacity = capacity
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.metrics = {
+            "acquired": 0,
+            "queued": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "pauses": 0,
+        }
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS bucket ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), tokens REAL NOT NULL, "
+            "updated_at REAL NOT NULL, paused_until REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "INSERT OR IGNORE INTO bucket VALUES (0, ?, ?, 0)", (capacity, time.time())
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """One SQLite connection per thread, in WAL mode so readers never block the writer."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _reserve(self) -> float:
+        """Take one token, possibly going into debt, and return how long to wait for it."""
+        connection = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so the read-modify-write is atomic
+        # across processes
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated_at, paused_until = connection.execute(
+                "SELECT tokens, updated_at, paused_until FROM bucket WHERE id = 0"
+            ).fetchone()
+            now = time.time()
+            # Tokens only accrue once a pause is over
+            start = max(updated_at, min(paused_until, now))
+            tokens = min(self.capacity, tokens + max(now - start, 0.0) * self.rate) - 1
+            connection.execute(
+                "UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 0",
+                (tokens, max(now, updated_at)),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        # A debt is only paid off by tokens accrued after the pause
+        return max(paused_until - now, 0.0) + max(-tokens / self.rate, 0.0)
+
+    def acquire(self) -> float:
+        """
+        Block until a request may be sent.
+
+        Returns:
+            float: The queueing delay in seconds.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        with self._lock:
+            self.metrics["acquired"] += 1
+            self.metrics["queued"] += wait > 0
+            self.metrics["wait_seconds_total"] += wait
+            self.metrics["wait_seconds_max"] = max(self.metrics["wait_seconds_max"], wait)
+            self._waits.append(wait)
+        return wait
+
+    def pause(self, seconds: float):
+        """Stop handing out tokens for `seconds`, e.g. after Artsy answered 429."""
+        until = time.time() + seconds
+        self._connection().execute(
+            "UPDATE bucket SET paused_until = MAX(paused_until, ?), tokens = MIN(tokens, 0) "
+            "WHERE id = 0",
+            (until,),
+        )
+        with self._lock:
+            self.metrics["pauses"] += 1
+
+    def stats(self) -> dict:
+        """Return the queueing metrics, with percentiles over the last 1000 acquisitions."""
+        with self._lock:
+            metrics = dict(self.metrics)
+            waits = sorted(self._waits) or [0.0]
+        metrics["wait_seconds_p50"] = waits[len(waits) // 2]
+        metrics["wait_seconds_p95"] = waits[min(int(len(waits) * 0.95), len(waits) - 1)]
+        metrics["wait_seconds_mean"] = (
+            metrics["wait_seconds_total"] / metrics["acquired"] if metrics["acquired"] else 0.0
+        )
+        return metrics
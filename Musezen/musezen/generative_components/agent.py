@@ -1,9 +1,42 @@
+import asyncio
+import contextvars
 import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from musezen.generative_components.agent_tools import AgentTool
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+from musezen.generative_components.agent_history import HistoryManager
+from musezen.generative_components.agent_response_cache import SemanticResponseCache
+from musezen.generative_components.agent_tool_cache import ToolResultCache, get_tool_cache
+from musezen.generative_components.agent_tools import AgentTool, estimate_tokens
 from musezen.generative_components.llm_client_base import LLMClient
 
 from openai.types.chat.chat_completion import ChatCompletion
+from openai.types.chat.chat_completion_message_tool_call import (
+    ChatCompletionMessageToolCall,
+    Function,
+)
+
+# Tool calls of every session run on one pool, so the limit holds for the whole process. A
+# timed out call keeps its worker until the tool returns, this also bounds those
+MAX_PARALLEL_TOOLS = 16
+
+_tool_pool = None
+_tool_pool_lock = threading.Lock()
+# The thread attribute holding the session's ScriptRunContext, set by `add_script_run_ctx`
+_SCRIPT_RUN_CTX_ATTR = "streamlit_script_run_ctx"
+
+
+def get_tool_pool() -> ThreadPoolExecutor:
+    """Return the process-wide thread pool running the blocking tool calls of all agents."""
+    global _tool_pool
+    with _tool_pool_lock:
+        if _tool_pool is None:
+            _tool_pool = ThreadPoolExecutor(MAX_PARALLEL_TOOLS, "agent-tool")
+        return _tool_pool
 
 
 class ChatAgent:
@@ -12,46 +45,265 @@ class ChatAgent:
         llm_client: LLMClient,
         chat_history: list[dict],
         tools: list[AgentTool] = [],
+        tool_pool: ThreadPoolExecutor | None = None,
+        tool_timeout: float = 30.0,
+        history_manager: HistoryManager | None = None,
+        response_cache: SemanticResponseCache | None = None,
+        tool_cache: ToolResultCache | None = None,
     ):
+        """
+        Args:
+            llm_client (LLMClient): The client of the language model.
+            chat_history (list[dict]): The initial messages, usually the system prompt.
+            tools (list[AgentTool], optional): Tools the model may call. Defaults to [].
+            tool_pool (ThreadPoolExecutor | None, optional): Runs the tool calls of a response
+                concurrently. Defaults to the process-wide pool of MAX_PARALLEL_TOOLS workers.
+            tool_timeout (float, optional): Seconds after which a tool call is reported to the
+                model as timed out. Defaults to 30.
+            history_manager (HistoryManager | None, optional): Trims the history sent to the
+                model to a token budget. Defaults to None, sending the full history.
+            response_cache (SemanticResponseCache | None, optional): Answers to first-turn
+                questions shared by all sessions, see `cache_context` of `invoke`. Defaults to
+                None.
+            tool_cache (ToolResultCache | None, optional): Memoizes and coalesces the calls of
+                idempotent tools. Defaults to the process-wide cache, shared by all sessions.
+        """
         self.llm_client = llm_client
         self.chat_history = chat_history
         self.tools = []
         self.execs = {}
+        self.async_execs = {}
+        self.output_schemas = {}
+        # Tool name -> (ttl, key function) of the idempotent tools
+        self.cache_policies = {}
+        self.tool_cache = tool_cache if tool_cache is not None else get_tool_cache()
+        # Tool name -> outputs compacted, and the bytes and estimated tokens that saved
+        self.compaction_stats = {}
+        self.tool_timeout = tool_timeout
+        self.history_manager = history_manager
+        # The background summary update of the last `ainvoke`, referenced so it is not collected
+        self._summary_task = None
+        # Timings of the last `stream` call, e.g. the time to first token
+        self.stream_stats = {}
+        self.response_cache = response_cache
+        # Provenance of the cached answer of the last turn, None if it was generated
+        self.last_cache_hit = None
+        self._tool_pool = tool_pool if tool_pool is not None else get_tool_pool()
         if tools:
             [self.add_tools(t) for t in tools]
 
     def add_tools(self, tool: AgentTool):
         self.tools.append(tool.description)
         self.execs[tool.name] = tool.executable
+        if tool.async_executable is not None:
+            self.async_execs[tool.name] = tool.async_executable
+        self.output_schemas[tool.name] = tool.output_schema
+        if tool.idempotent:
+            self.cache_policies[tool.name] = (tool.cache_ttl, tool.cache_key)
+
+    def _prompt(self, model: str) -> list[dict]:
+        """The messages to send to the model, the full history unless it is managed."""
+        if self.history_manager is None:
+            return self.chat_history
+        return self.history_manager.prompt(self.chat_history, model)
+
+    def _cache_scope(self, cache_context: dict | None) -> dict | None:
+        """
+        The context a turn's answer is cached under, None if it must not be cached: only
+        first-turn questions without per-session context are answered from the cache.
+        """
+        if self.response_cache is None or cache_context is None:
+            return None
+        if any(message["role"] == "user" for message in self.chat_history):
+            return None
+        return cache_context
+
+    def _cached_answer(self, input_message: str, model: str, cache_context: dict | None):
+        """The cached answer of a turn, appended to the history as if generated, or None."""
+        self.last_cache_hit = None
+        scope = self._cache_scope(cache_context)
+        if scope is None:
+            return None
+        context = {k: v for k, v in scope.items() if k != "question"}
+        hit = self.response_cache.get(scope.get("question", input_message), model, context)
+        if hit is None:
+            return None
+        self.last_cache_hit = hit["provenance"]
+        self.chat_history.append({"role": "user", "content": input_message})
+        self.chat_history.append({"role": "assistant", "content": hit["response"]})
+        return hit["response"]
+
+    def _cache_answer(self, input_message: str, model: str, scope: dict | None, start: int):
+        """Store the answer of a turn that started at history index `start`."""
+        response_message = self.chat_history[-1]["content"]
+        if scope is None or not response_message:
+            return
+        tools = [
+            tool_call.function.name
+            for message in self.chat_history[start:]
+            for tool_call in message.get("tool_calls") or []
+        ]
+        context = {k: v for k, v in scope.items() if k != "question"}
+        self.response_cache.put(
+            scope.get("question", input_message), model, response_message, context, tools
+        )
+
+    def compact_output(self, function_name: str, function_response) -> str:
+        """
+        Serialize a tool output for the chat history, applying the tool's output schema, and
+        record how much it saved.
+        """
+        raw = json.dumps(function_response)
+        schema = self.output_schemas.get(function_name)
+        if schema is None:
+            return raw
+        content = schema.compact(function_response)
+        stats = self.compaction_stats.setdefault(
+            function_name, {"outputs": 0, "raw_bytes": 0, "bytes": 0, "tokens_saved": 0}
+        )
+        stats["outputs"] += 1
+        stats["raw_bytes"] += len(raw.encode())
+        stats["bytes"] += len(content.encode())
+        stats["tokens_saved"] += estimate_tokens(raw) - estimate_tokens(content)
+        return content
+
+    def _tool_key(self, function_name: str, arguments: dict) -> tuple | None:
+        """The cache key of a call, None if the call must not go through the cache."""
+        if function_name not in self.cache_policies:
+            return None
+        key_function = self.cache_policies[function_name][1]
+        if key_function is not None:
+            key = key_function(**arguments)
+            # An empty key, e.g. of a query without letters, would mix up unrelated calls
+            return (function_name, key) if key else None
+        return (function_name, json.dumps(arguments, sort_keys=True))
+
+    def _submit_tool(self, function_name: str, arguments: str) -> Future:
+        """
+        Run a blocking tool on the pool, inside a copy of the caller's context: Streamlit keeps
+        the active container, e.g. the `with status:` box the tools write progress into, in a
+        ContextVar that pool threads do not inherit.
+        """
+        ctx = get_script_run_ctx(suppress_warning=True)
+        context = contextvars.copy_context()
+        return self._tool_pool.submit(context.run, self._run_tool, function_name, arguments, ctx)
+
+    def _run_tool(self, function_name: str, arguments: str, ctx):
+        # Tools write progress to the page, which needs the session's script context
+        thread = threading.current_thread()
+        previous = getattr(thread, _SCRIPT_RUN_CTX_ATTR, None)
+        if ctx is not None:
+            add_script_run_ctx(ctx=ctx)
+        try:
+            arguments = json.loads(arguments)
+            key = self._tool_key(function_name, arguments)
+            if key is None:
+                return self.execs[function_name](**arguments)
+            return self.tool_cache.call(
+                key,
+                lambda: self.execs[function_name](**arguments),
+                self.cache_policies[function_name][0],
+            )
+        finally:
+            # Pool threads are shared by all sessions, none may keep this session's context
+            setattr(thread, _SCRIPT_RUN_CTX_ATTR, previous)
 
     def function_calling(self, tool_calls: list):
         """
-        This function calls the function specified in the LLM response and appends the result to
-        the instance chat history.
+        This function calls the functions specified in the LLM response concurrently and appends
+        the results to the instance chat history, in the order of the tool calls.
+
+        A failing or timed out call is reported to the model as an error result instead of
+        failing the whole turn.
         """
+        futures = []
         for tool_call in tool_calls:
             print(tool_call)
-            function_name = tool_call.function.name
-            function_args = json.loads(tool_call.function.arguments)
-            # TODO: Might require error handling since JSON might not always contain valid parameters
-            function_response = self.execs[function_name](**function_args)
+            futures.append(self._submit_tool(tool_call.function.name, tool_call.function.arguments))
 
+        deadline = time.monotonic() + self.tool_timeout
+        for tool_call, future in zip(tool_calls, futures):
+            try:
+                result = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except Exception as e:
+                # Drops a call still queued behind other sessions' calls, a running tool cannot
+                # be interrupted and keeps its worker until it returns
+                future.cancel()
+                result = e
             # Update chat history with the function responses
-            self.chat_history.append(
-                {
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": json.dumps(function_response),
-                }
+            self.chat_history.append(self._tool_message(tool_call, result))
+
+    def _tool_message(self, tool_call, result) -> dict:
+        """The chat history entry of a tool result, or of the exception the call raised."""
+        function_name = tool_call.function.name
+        if isinstance(result, (FutureTimeoutError, asyncio.TimeoutError)):
+            content = json.dumps(
+                {"error": f"{function_name} timed out after {self.tool_timeout}s"}
             )
+        elif isinstance(result, BaseException):
+            content = json.dumps({"error": f"{type(result).__name__}: {result}"})
+        else:
+            content = self.compact_output(function_name, result)
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": function_name,
+            "content": content,
+        }
+
+    async def afunction_calling(self, tool_calls: list):
+        """
+        Async variant of `function_calling`. Async executables run on the event loop, the
+        blocking ones on the agent's bounded tool pool.
+        """
+
+        async def call(tool_call):
+            function_name = tool_call.function.name
+            if function_name in self.async_execs:
+                arguments = json.loads(tool_call.function.arguments)
+                key = self._tool_key(function_name, arguments)
+                if key is not None:
+                    pending = self.tool_cache.acall(
+                        key,
+                        lambda: self.async_execs[function_name](**arguments),
+                        self.cache_policies[function_name][0],
+                    )
+                else:
+                    pending = self.async_execs[function_name](**arguments)
+            else:
+                pending = asyncio.wrap_future(
+                    self._submit_tool(function_name, tool_call.function.arguments)
+                )
+            return await asyncio.wait_for(pending, self.tool_timeout)
+
+        results = await asyncio.gather(
+            *(call(tool_call) for tool_call in tool_calls), return_exceptions=True
+        )
+        for tool_call, result in zip(tool_calls, results):
+            self.chat_history.append(self._tool_message(tool_call, result))
 
-    def invoke(self, input_message: str, model: str):
+    def invoke(self, input_message: str, model: str, cache_context: dict | None = None):
+        """
+        Answer a user message, calling tools until the model produces a final answer.
+
+        Args:
+            input_message (str): The user message.
+            model (str): The model name.
+            cache_context (dict | None, optional): Makes a first-turn answer cacheable by the
+                `response_cache`: the context it depends on, e.g. the predicted style, and
+                optionally the user's `question` when `input_message` wraps it in a prompt.
+                Defaults to None, for turns that depend on the session, e.g. on similar
+                artworks.
+        """
+        cached = self._cached_answer(input_message, model, cache_context)
+        if cached is not None:
+            return cached
+        scope, start = self._cache_scope(cache_context), len(self.chat_history)
         self.chat_history.append({"role": "user", "content": input_message})
 
         # Initial request to the language model
         response: ChatCompletion = self.llm_client.send_message(
-            model, self.chat_history, tools=self.tools
+            model, self._prompt(model), tools=self.tools
         )
         continue_function_calls = True
 
@@ -77,7 +329,7 @@ class ChatAgent:
 
                 # Send updated chat history back to the model
                 response = self.llm_client.send_message(
-                    model=model, messages=self.chat_history, tools=self.tools
+                    model=model, messages=self._prompt(model), tools=self.tools
                 )
             else:
                 continue_function_calls = False
@@ -89,8 +341,127 @@ class ChatAgent:
                     }
                 )
 
+        self._cache_answer(input_message, model, scope, start)
+        if self.history_manager is not None:
+            # After the answer, so the summarizer never delays a model call
+            self.history_manager.update_summary_in_background()
         # Return the last computed response message
         return response_message
 
+    def _stream_response(self, model: str):
+        """
+        Stream one model response, yielding content deltas as they arrive.
+
+        Returns:
+            tuple: The full content and the tool calls assembled from their argument deltas.
+        """
+        content, tool_calls = [], {}
+        for chunk in self.llm_client.stream_message(
+            model=model, messages=self._prompt(model), tools=self.tools
+        ):
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+                yield delta.content
+            # Tool calls arrive as fragments keyed by index: the id and name first, then pieces
+            # of the JSON arguments
+            for fragment in delta.tool_calls or []:
+                call = tool_calls.setdefault(
+                    fragment.index, {"id": None, "name": "", "arguments": ""}
+                )
+                call["id"] = fragment.id or call["id"]
+                if fragment.function is not None:
+                    call["name"] += fragment.function.name or ""
+                    call["arguments"] += fragment.function.arguments or ""
+        return "".join(content) or None, [
+            ChatCompletionMessageToolCall(
+                id=call["id"],
+                type="function",
+                function=Function(name=call["name"], arguments=call["arguments"]),
+            )
+            for _, call in sorted(tool_calls.items())
+        ]
+
+    def stream(self, input_message: str, model: str, cache_context: dict | None = None):
+        """
+        Streaming variant of `invoke`: runs the same model/tool loop and yields the answer's
+        tokens as soon as the model produces them. `stream_stats` records the time to first
+        token and the total time of the turn.
+        """
+        start = time.perf_counter()
+        self.stream_stats = {"ttft_s": None, "total_s": None, "model_calls": 0}
+        cached = self._cached_answer(input_message, model, cache_context)
+        if cached is not None:
+            self.stream_stats["ttft_s"] = self.stream_stats["total_s"] = (
+                time.perf_counter() - start
+            )
+            yield cached
+            return
+        scope, turn_start = self._cache_scope(cache_context), len(self.chat_history)
+        self.chat_history.append({"role": "user", "content": input_message})
+        while True:
+            self.stream_stats["model_calls"] += 1
+            response = self._stream_response(model)
+            while True:
+                try:
+                    token = next(response)
+                except StopIteration as stop:
+                    response_message, tool_calls = stop.value
+                    break
+                if self.stream_stats["ttft_s"] is None:
+                    self.stream_stats["ttft_s"] = time.perf_counter() - start
+                yield token
+            if not tool_calls:
+                break
+            self.chat_history.append(
+                {
+                    "role": "assistant",
+                    "content": response_message,
+                    "tool_calls": tool_calls,
+                }
+            )
+            self.function_calling(tool_calls)
+
+        self.chat_history.append({"role": "assistant", "content": response_message})
+        self._cache_answer(input_message, model, scope, turn_start)
+        if self.history_manager is not None:
+            self.history_manager.update_summary_in_background()
+        self.stream_stats["total_s"] = time.perf_counter() - start
+
+    async def ainvoke(self, input_message: str, model: str, cache_context: dict | None = None):
+        """
+        Async variant of `invoke`: the conversation waits on the model and the tools without
+        holding a thread, so many conversations can share one event loop.
+        """
+        cached = self._cached_answer(input_message, model, cache_context)
+        if cached is not None:
+            return cached
+        scope, start = self._cache_scope(cache_context), len(self.chat_history)
+        self.chat_history.append({"role": "user", "content": input_message})
+        while True:
+            response: ChatCompletion = await self.llm_client.asend_message(
+                model=model, messages=self._prompt(model), tools=self.tools
+            )
+            response_message = response.choices[0].message.content
+            tool_calls = response.choices[0].message.tool_calls
+            if not tool_calls:
+                break
+            self.chat_history.append(
+                {
+                    "role": "assistant",
+                    "content": response_message,
+                    "tool_calls": tool_calls,
+                }
+            )
+            await self.afunction_calling(tool_calls)
+
+        self.chat_history.append({"role": "assistant", "content": response_message})
+        self._cache_answer(input_message, model, scope, start)
+        if self.history_manager is not None:
+            self._summary_task = asyncio.ensure_future(self.history_manager.aupdate_summary())
+        return response_message
+
     def get_chat_history(self):
         return self.chat_history
\ No newline at end of file
@@ -0,0 +1,293 @@
+import asyncio
+import json
+import threading
+from typing import Callable
+
+from musezen.generative_components.agent_tools import estimate_tokens
+from musezen.generative_components.llm_client_base import LLMClient
+
+# Prompt token budgets per model, far below the context windows: every token of history is paid
+# again on every model call of every later turn
+DEFAULT_PROMPT_BUDGETS = {
+    "gpt-4o-mini": 12_000,
+    "gpt-4o": 12_000,
+}
+DEFAULT_PROMPT_BUDGET = 8_000
+# Per message overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and an art curator in a few sentences. Keep "
+    "the artworks, artists, styles and user preferences that were mentioned, drop the rest."
+)
+
+
+def is_image_context(message: dict) -> bool:
+    """User messages carrying the uploaded painting's context, see musezen_chat.py."""
+    content = message.get("content")
+    return message["role"] == "user" and isinstance(content, str) and content.startswith(
+        "Context: the user uploaded image"
+    )
+
+
+def _summary_messages(previous_summary: str | None, messages: list[dict]) -> list[dict]:
+    transcript = "\n".join(
+        f"{m['role']}: {m['content']}"
+        for m in messages
+        if m["role"] in ("user", "assistant") and m.get("content")
+    )
+    if previous_summary:
+        transcript = f"Earlier summary: {previous_summary}\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": transcript},
+    ]
+
+
+def llm_summarizer(llm_client: LLMClient, model: str = "gpt-4o-mini") -> Callable:
+    """A `summarize(previous_summary, messages)` function backed by a (cheap) chat model."""
+
+    def summarize(previous_summary: str | None, messages: list[dict]) -> str:
+        response = llm_client.send_message(
+            model, _summary_messages(previous_summary, messages), max_tokens=300
+        )
+        return response.choices[0].message.content
+
+    return summarize
+
+
+def async_llm_summarizer(llm_client: LLMClient, model: str = "gpt-4o-mini") -> Callable:
+    """Coroutine variant of `llm_summarizer`, for `HistoryManager.aupdate_summary`."""
+
+    async def summarize(previous_summary: str | None, messages: list[dict]) -> str:
+        response = await llm_client.asend_message(
+            model, _summary_messages(previous_summary, messages), max_tokens=300
+        )
+        return response.choices[0].message.content
+
+    return summarize
+
+
+class HistoryManager:
+    """
+    Builds the prompt sent to the model from the full chat history within a token budget.
+
+    The chat history itself is never modified. When it exceeds the budget, old tool results are
+    replaced by a short stub first, then the oldest turns are dropped, optionally folded into a
+    rolling summary. The system prompt, the latest image context, the most recent turns and
+    every tool_call/tool pair are always kept.
+
+    Building a prompt never waits for the summarizer: dropped turns are folded into the summary
+    after the turn, by `update_summary_in_background` or `aupdate_summary`, and the prompts
+    that follow include it.
+    """
+
+    def __init__(
+        self,
+        budgets: dict = DEFAULT_PROMPT_BUDGETS,
+        default_budget: int = DEFAULT_PROMPT_BUDGET,
+        keep_recent_turns: int = 2,
+        summarize: Callable | None = None,
+        asummarize: Callable | None = None,
+        count_tokens: Callable = estimate_tokens,
+        is_pinned: Callable = is_image_context,
+    ):
+        """
+        Args:
+            budgets (dict, optional): Prompt token budget per model name.
+            default_budget (int, optional): Budget of the other models. Defaults to 8000.
+            keep_recent_turns (int, optional): User turns, with their tool calls and answers,
+                that are never compressed or dropped. Defaults to 2.
+            summarize (Callable | None, optional): `summarize(previous_summary, messages)`
+                folding dropped turns into a rolling summary, e.g. `llm_summarizer(llm)`.
+                Defaults to None, dropping them.
+            asummarize (Callable | None, optional): Coroutine variant used by
+                `aupdate_summary`, e.g. `async_llm_summarizer(llm)`. Defaults to None, running
+                `summarize` on a thread.
+            count_tokens (Callable, optional): Token counter of a text. Defaults to an estimate.
+            is_pinned (Callable, optional): Predicate of the messages to always keep, only the
+                latest match is pinned. Defaults to the uploaded image context.
+        """
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summarize = summarize
+        self.asummarize = asummarize
+        self.count_tokens = count_tokens
+        self.is_pinned = is_pinned
+        # id(message) -> (message, tokens); the message is kept so its id cannot be reused
+        self._counts = {}
+        self._stubs = {}
+        self._summary = None
+        self._summary_message = None
+        self._summarized = set()
+        # Dropped messages not covered by the summary yet
+        self._pending = []
+        self._summary_lock = threading.Lock()
+        self._summarizing = False
+        self.last_stats = {}
+
+    def tokens(self, message: dict) -> int:
+        """Token count of a message, computed once per message."""
+        cached = self._counts.get(id(message))
+        if cached is not None and cached[0] is message:
+            return cached[1]
+        text = message.get("content") or ""
+        if not isinstance(text, str):
+            text = json.dumps(text)
+        for call in message.get("tool_calls") or []:
+            function = call["function"] if isinstance(call, dict) else call.function
+            name = function["name"] if isinstance(function, dict) else function.name
+            arguments = (
+                function["arguments"] if isinstance(function, dict) else function.arguments
+            )
+            text += name + arguments
+        tokens = self.count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+        self._counts[id(message)] = (message, tokens)
+        return tokens
+
+    @staticmethod
+    def _turns(messages: list[dict]) -> list[list[int]]:
+        """Split message indices into turns, each starting at a user message."""
+        turns = []
+        for i, message in enumerate(messages):
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(i)
+        return turns
+
+    def _stub(self, message: dict) -> dict:
+        """The compressed copy of a tool result, created once per message."""
+        cached = self._stubs.get(id(message))
+        if cached is None or cached[0] is not message:
+            stub = {
+                **message,
+                "content": json.dumps(
+                    {"omitted": f"earlier {message.get('name', 'tool')} result removed"}
+                ),
+            }
+            cached = self._stubs[id(message)] = (message, stub)
+        return cached[1]
+
+    def prompt(self, history: list[dict], model: str) -> list[dict]:
+        """Return the messages to send for `model`, within its token budget."""
+        budget = self.budgets.get(model, self.default_budget)
+        messages = list(history)
+        total = sum(self.tokens(m) for m in messages)
+        self.last_stats = {
+            "history_tokens": total,
+            "prompt_tokens": total,
+            "compressed": 0,
+            "dropped": 0,
+        }
+        if total <= budget:
+            return messages
+
+        protected = set()
+        if messages and messages[0]["role"] == "system":
+            protected.add(0)
+        pinned = [i for i, m in enumerate(messages) if self.is_pinned(m)]
+        if pinned:
+            protected.add(pinned[-1])
+        turns = self._turns(messages)
+        old_turns = turns[: max(len(turns) - self.keep_recent_turns, 0)]
+
+        # Old tool results are the bulk of the history and the least useful later on
+        for turn in old_turns:
+            for i in turn:
+                if total <= budget:
+                    break
+                if messages[i]["role"] == "tool":
+                    stub = self._stub(messages[i])
+                    total += self.tokens(stub) - self.tokens(messages[i])
+                    messages[i] = stub
+                    self.last_stats["compressed"] += 1
+
+        # Then whole turns, so assistant tool_calls never lose their tool results
+        dropped = []
+        for turn in old_turns:
+            if total <= budget:
+                break
+            for i in turn:
+                if i not in protected:
+                    dropped.append(i)
+                    total -= self.tokens(messages[i])
+
+        message = self._summary_message
+        if dropped and (self.summarize is not None or self.asummarize is not None):
+            with self._summary_lock:
+                self._pending = [
+                    history[i] for i in dropped if id(history[i]) not in self._summarized
+                ]
+                message = self._summary_message
+        dropped = set(dropped)
+        prompt = [m for i, m in enumerate(messages) if i not in dropped]
+        if dropped and message is not None:
+            prompt.insert(1 if 0 in protected else 0, message)
+            total += self.tokens(message)
+        self.last_stats.update(prompt_tokens=total, dropped=len(dropped))
+        return prompt
+
+    def _claim_pending(self) -> tuple | None:
+        """Take the pending messages for one summarizer call, None if there is nothing to do."""
+        with self._summary_lock:
+            if self._summarizing or not self._pending:
+                return None
+            self._summarizing = True
+            return self._summary, list(self._pending)
+
+    def _store_summary(self, messages: list[dict], summary: str | None):
+        with self._summary_lock:
+            self._summarizing = False
+            if summary is None:
+                return
+            self._summary = summary
+            if self._summary_message is not None:
+                self._counts.pop(id(self._summary_message), None)
+            # One message per summary, so its token count is cached once
+            self._summary_message = {
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary}",
+            }
+            self._summarized.update(id(m) for m in messages)
+            self._pending = [m for m in self._pending if id(m) not in self._summarized]
+
+    def update_summary(self):
+        """Fold the turns dropped from the last prompt into the rolling summary."""
+        claimed = self._claim_pending()
+        if claimed is None:
+            return
+        previous, messages = claimed
+        summary = None
+        try:
+            summary = self.summarize(previous, messages)
+        except Exception as e:
+            # The turns stay pending and are summarized after the next turn
+            print(f"Summarizing the history failed: {type(e).__name__}: {e}")
+        finally:
+            self._store_summary(messages, summary)
+
+    def update_summary_in_background(self):
+        """Run `update_summary` on a thread, e.g. once a turn has been answered."""
+        if self.summarize is not None and self._pending and not self._summarizing:
+            threading.Thread(
+                target=self.update_summary, name="history-summary", daemon=True
+            ).start()
+
+    async def aupdate_summary(self):
+        """Async variant of `update_summary`, without blocking the event loop."""
+        if self.asummarize is None:
+            if self.summarize is not None:
+                await asyncio.to_thread(self.update_summary)
+            return
+        claimed = self._claim_pending()
+        if claimed is None:
+            return
+        previous, messages = claimed
+        summary = None
+        try:
+            summary = await self.asummarize(previous, messages)
+        except Exception as e:
+            print(f"Summarizing the history failed: {type(e).__name__}: {e}")
+        finally:
+            self._store_summary(messages, summary)
@@ -0,0 +1,245 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from musezen.external_integrations.ArtsyCatalog import normalize
+
+# Filler words of curator questions: "what is Impressionism?" and "tell me about impressionism"
+# are the same question
+QUESTION_STOPWORDS = set(
+    "a an the what whats is are was were who whos tell me about can could you please explain "
+    "describe give some info information on of i would like to know do does it this that".split()
+)
+# Shortest word in which `same_terms` tolerates a typo: "manet" is not "monet", and with one
+# edit at most "expressionism" is not "impressionism" either
+TYPO_MIN_LENGTH = 8
+
+
+def normalize_question(text: str) -> str:
+    """Casefold, drop punctuation and question filler words, keeping letters of every script."""
+    words = normalize(text.casefold().replace("'s", "").replace("\u2019s", "")).split()
+    return " ".join(w for w in words if w not in QUESTION_STOPWORDS)
+
+
+def hashed_ngram_embedding(texts: list[str], dim: int = 2048) -> np.ndarray:
+    """
+    Local, dependency-free embeddings: hashed character trigrams, L2-normalized. They catch
+    rephrasings and typos of the same question in microseconds, not synonyms.
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        padded = f" {text} "
+        for i in range(len(padded) - 2):
+            vectors[row, zlib.crc32(padded[i : i + 3].encode()) % dim] += 1
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """Whether two words differ by at most one insertion, deletion, substitution or swap."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diff) == 2 and diff[1] == diff[0] + 1:
+            return a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]]
+        return len(diff) <= 1
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1 :]
+
+
+def same_terms(question: str, cached: str) -> bool:
+    """
+    Whether two normalized questions ask about the same terms, up to word order and a typo in
+    long words. Character n-grams alone rate "german impressionism" close to "german
+    expressionism", so every content word must match.
+    """
+    words, cached_words = question.split(), cached.split()
+    if len(words) != len(cached_words):
+        return False
+
+    def close(a: str, b: str) -> bool:
+        if a == b:
+            return True
+        if a.isalpha() and b.isalpha() and min(len(a), len(b)) >= TYPO_MIN_LENGTH:
+            return within_one_edit(a, b)
+        return False
+
+    return all(any(close(a, b) for b in cached_words) for a in words) and all(
+        any(close(a, b) for b in words) for a in cached_words
+    )
+
+
+def openai_embedder(client, model: str = "text-embedding-3-small") -> Callable:
+    """Semantic embeddings from the OpenAI API, one network round-trip per lookup."""
+
+    def embed(texts: list[str]) -> np.ndarray:
+        response = client.embeddings.create(model=model, input=texts)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+    return embed
+
+
+class SemanticResponseCache:
+    """
+    Caches the agent's answers to context-free questions, so frequent ones ("what is
+    Impressionism?") skip the LLM and tool loop.
+
+    Answers are scoped by model and context (e.g. the predicted style) and looked up by the
+    normalized question, first exactly, then by embedding similarity within the scope.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = 24 * 60 * 60,
+        threshold: float = 0.85,
+        embed: Callable = hashed_ngram_embedding,
+        verify: Callable | None = same_terms,
+    ):
+        """
+        Args:
+            max_size (int, optional): Maximum number of answers kept. Defaults to 1024.
+            ttl (float, optional): Seconds an answer stays valid. Defaults to a day.
+            threshold (float, optional): Minimum cosine similarity of a semantic hit. Defaults
+                to 0.85.
+            embed (Callable, optional): Maps a list of texts to L2-normalized row vectors.
+                Defaults to `hashed_ngram_embedding`, see also `openai_embedder`.
+            verify (Callable | None, optional): `verify(question, cached_question)` confirming
+                a semantic hit on the normalized questions. Defaults to `same_terms`, use None
+                with semantic embeddings.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.embed = embed
+        self.verify = verify
+        # (scope, question) -> entry dict, in LRU order
+        self._entries = OrderedDict()
+        # scope -> (keys, stacked embeddings), rebuilt after changes to the scope
+        self._matrices = {}
+        self._lock = threading.Lock()
+        self.metrics = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @staticmethod
+    def scope(model: str, context: dict | None) -> tuple:
+        return (model, tuple(sorted((context or {}).items())))
+
+    def _purge(self):
+        """Drop expired entries. Must hold self._lock."""
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl]
+        for key in expired:
+            self._drop(key)
+
+    def _drop(self, key: tuple):
+        del self._entries[key]
+        self._matrices.pop(key[0], None)
+
+    def get(self, question: str, model: str, context: dict | None = None) -> dict | None:
+        """
+        Look up the answer to a question.
+
+        Returns:
+            dict | None: On a hit, the `response` and its `provenance`: the original question,
+                model, context, tools used, age, hit count, match type and similarity.
+        """
+        scope, text = self.scope(model, context), normalize_question(question)
+        with self._lock:
+            self._purge()
+            if (scope, text) in self._entries:
+                return self._hit((scope, text), text, 1.0)
+        # Embedding may be a network round-trip, other sessions must not wait for it
+        query = self.embed([text])[0]
+        with self._lock:
+            key, similarity = self._nearest(scope, text, query)
+            if key is None:
+                self.metrics["misses"] += 1
+                return None
+            return self._hit(key, text, similarity)
+
+    def _hit(self, key: tuple, text: str, similarity: float) -> dict:
+        """Count a hit and return the answer with its provenance. Must hold self._lock."""
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        entry["hits"] += 1
+        match = "exact" if similarity == 1.0 and key[1] == text else "semantic"
+        self.metrics[f"{match}_hits"] += 1
+        return {
+            "response": entry["response"],
+            "provenance": {
+                **entry["provenance"],
+                "age_s": time.time() - entry["created_at"],
+                "hits": entry["hits"],
+                "match": match,
+                "similarity": similarity,
+            },
+        }
+
+    def _nearest(self, scope: tuple, text: str, query: np.ndarray) -> tuple:
+        """
+        The most similar cached question of the scope above the threshold, `query` is the
+        embedding of `text`. Must hold self._lock.
+        """
+        if scope not in self._matrices:
+            keys = [key for key in self._entries if key[0] == scope]
+            if not keys:
+                return None, 0.0
+            self._matrices[scope] = (
+                keys,
+                np.stack([self._entries[key]["embedding"] for key in keys]),
+            )
+        keys, matrix = self._matrices[scope]
+        similarities = matrix @ query
+        best = int(similarities.argmax())
+        if similarities[best] < self.threshold:
+            return None, 0.0
+        if self.verify is not None and not self.verify(text, keys[best][1]):
+            return None, 0.0
+        return keys[best], float(similarities[best])
+
+    def put(
+        self,
+        question: str,
+        model: str,
+        response: str,
+        context: dict | None = None,
+        tools: list[str] = [],
+    ):
+        """Store an answer with its provenance: the question, model, context and tools used."""
+        scope, text = self.scope(model, context), normalize_question(question)
+        if not text:
+            return
+        embedding = self.embed([text])[0]
+        with self._lock:
+            if (scope, text) in self._entries:
+                self._drop((scope, text))
+            self._entries[(scope, text)] = {
+                "response": response,
+                "embedding": embedding,
+                "created_at": time.time(),
+                "hits": 0,
+                "provenance": {
+                    "question": question,
+                    "model": model,
+                    "context": context or {},
+                    "tools": tools,
+                    "created_at": time.time(),
+                },
+            }
+            self._matrices.pop(scope, None)
+            self._purge()
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.metrics, "entries": len(self._entries)}
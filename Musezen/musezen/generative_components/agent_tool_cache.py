@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future
+from typing import Callable
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_tool_cache():
+    """Return the process-wide tool result cache, shared by the agents of all sessions."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ToolResultCache()
+        return _shared_cache
+
+
+class ToolResultCache:
+    """
+    Memoizes the results of idempotent tool calls and coalesces concurrent identical calls into
+    a single in-flight execution (single-flight).
+
+    Callers of a key that is already running wait for its result instead of executing it again,
+    whether they are threads or coroutines on any event loop. Failures are passed on to every
+    waiter and never memoized, the cancellation of a caller is not: async executions run
+    detached from the caller that started them. Results are shared between callers and must
+    not be mutated.
+    """
+
+    def __init__(self, max_size: int = 2048):
+        """
+        Args:
+            max_size (int, optional): Maximum number of memoized results. Defaults to 2048.
+        """
+        self.max_size = max_size
+        # key -> (expires_at, result), in LRU order
+        self._results = OrderedDict()
+        # key -> Future of the running execution
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # tool -> counters, the key's first element is the tool name
+        self.metrics = {}
+        # Detached async executions, referenced until done so they are not garbage collected
+        self._tasks = set()
+
+    def _count(self, key: tuple, outcome: str):
+        """Must hold self._lock."""
+        counters = self.metrics.setdefault(
+            key[0], {"calls": 0, "hits": 0, "coalesced": 0, "executions": 0, "errors": 0}
+        )
+        counters[outcome] += 1
+        if outcome in ("hits", "coalesced", "executions"):
+            counters["calls"] += 1
+
+    def _claim(self, key: tuple) -> tuple:
+        """
+        Returns:
+            tuple: ("hit", result), ("wait", future) for a call in flight, or ("run", future)
+                for a new execution the caller must complete with `_finish`.
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self._results.move_to_end(key)
+                    self._count(key, "hits")
+                    return "hit", cached[1]
+                del self._results[key]
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._count(key, "coalesced")
+                return "wait", future
+            future = self._in_flight[key] = Future()
+            self._count(key, "executions")
+            return "run", future
+
+    def _finish(self, key: tuple, future: Future, ttl: float | None, result=None, error=None):
+        if error is not None and (
+            isinstance(error, CancelledError) or not isinstance(error, Exception)
+        ):
+            # An interrupted execution is a failure for the waiters, not their cancellation
+            error = RuntimeError(f"{key[0]} was interrupted ({type(error).__name__})")
+        with self._lock:
+            del self._in_flight[key]
+            if error is not None:
+                self._count(key, "errors")
+            elif ttl:
+                self._results[key] = (time.monotonic() + ttl, result)
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_size:
+                    self._results.popitem(last=False)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def call(self, key: tuple, execute: Callable, ttl: float | None = None):
+        """
+        Return the result of `execute()` for `key`: memoized, awaited from the identical call in
+        flight, or executed now.
+
+        Args:
+            key (tuple): Identifies the call, starting with the tool name.
+            execute (Callable): Runs the call without arguments.
+            ttl (float | None, optional): Seconds the result stays memoized. Defaults to None,
+                only coalescing concurrent calls.
+        """
+        state, value = self._claim(key)
+        if state == "hit":
+            return value
+        if state == "wait":
+            return value.result()
+        try:
+            result = execute()
+        except BaseException as e:
+            self._finish(key, value, ttl, error=e)
+            raise
+        self._finish(key, value, ttl, result)
+        return result
+
+    async def _execute(self, key: tuple, future: Future, execute: Callable, ttl: float | None):
+        try:
+            result = await execute()
+        except Exception as e:
+            self._finish(key, future, ttl, error=e)
+            return
+        except BaseException as e:
+            self._finish(key, future, ttl, error=e)
+            raise
+        self._finish(key, future, ttl, result)
+
+    async def acall(self, key: tuple, execute: Callable, ttl: float | None = None):
+        """
+        Async variant of `call`, `execute()` returns an awaitable. The execution runs as a task
+        of its own, so the timeout or cancellation of the caller that started it does not cancel
+        it for the callers waiting on the same key.
+        """
+        state, value = self._claim(key)
+        if state == "hit":
+            return value
+        if state == "run":
+            task = asyncio.ensure_future(self._execute(key, value, execute, ttl))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(asyncio.wrap_future(value))
+
+    def stats(self) -> dict:
+        """Counters per tool, plus the totals and the number of deduplicated calls."""
+        with self._lock:
+            tools = {tool: dict(counters) for tool, counters in self.metrics.items()}
+            total = {}
+            for counters in tools.values():
+                for name, count in counters.items():
+                    total[name] = total.get(name, 0) + count
+            total["deduplicated"] = total.get("hits", 0) + total.get("coalesced", 0)
+            total["entries"] = len(self._results)
+        return {"total": total, "tools": tools}
@@ -1,5 +1,163 @@
+import json
+import unicodedata
 from typing import Callable
 
+# Rough characters per token of JSON-heavy text, used where no tokenizer is at hand
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate for text sent to the model."""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def query_key(query: str) -> str:
+    """
+    Cache key of a free-text tool argument: casefolded, with runs of whitespace and punctuation
+    collapsed. Letters of every script are kept, "草間彌生" and "葛飾北斎" never share a key.
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    return " ".join(
+        "".join(c if unicodedata.category(c)[0] in "LNM" else " " for c in text).split()
+    )
+
+
+class ToolOutputSchema:
+    """
+    How to compact a tool's output before it enters the chat history.
+
+    The history is re-sent to the model on every turn, so every field kept here costs tokens on
+    every later request.
+    """
+
+    def __init__(
+        self,
+        fields: list[str] | None = None,
+        exclude: list[str] = [],
+        max_items: int | None = None,
+        max_chars: int | None = None,
+        max_tokens: int | None = None,
+    ):
+        """
+        Args:
+            fields (list[str] | None, optional): Dotted paths of the fields to keep, e.g.
+                "_links.thumbnail.href". Lists are traversed transparently, so
+                "_embedded.results.title" keeps the title of every result. Defaults to None,
+                keeping everything.
+            exclude (list[str], optional): Keys dropped wherever they appear, e.g. "curies".
+            max_items (int | None, optional): Maximum length of every list. Defaults to None.
+            max_chars (int | None, optional): Budget of the serialized output in characters.
+                Long strings are shortened first, then lists, then fields. Defaults to None.
+            max_tokens (int | None, optional): The same budget in (estimated) tokens.
+        """
+        self.fields = self._tree(fields) if fields is not None else None
+        self.exclude = set(exclude)
+        self.max_items = max_items
+        budgets = [b for b in (max_chars, max_tokens and max_tokens * CHARS_PER_TOKEN) if b]
+        self.max_chars = min(budgets) if budgets else None
+
+    @staticmethod
+    def _tree(fields: list[str]) -> dict:
+        tree = {}
+        for field in fields:
+            node = tree
+            for key in field.split("."):
+                node = node.setdefault(key, {})
+        return tree
+
+    def _select(self, value, tree: dict | None):
+        """Keep the fields of `tree` (everything if it is empty/None), minus excluded keys."""
+        if isinstance(value, list):
+            items = value[: self.max_items] if self.max_items is not None else value
+            return [self._select(item, tree) for item in items]
+        if isinstance(value, dict):
+            return {
+                key: self._select(item, tree.get(key) if tree else None)
+                for key, item in value.items()
+                if key not in self.exclude and (not tree or key in tree)
+            }
+        return value
+
+    @staticmethod
+    def _shorten_strings(value, max_length: int):
+        if isinstance(value, str) and len(value) > max_length:
+            return value[:max_length] + "..."
+        if isinstance(value, list):
+            return [ToolOutputSchema._shorten_strings(v, max_length) for v in value]
+        if isinstance(value, dict):
+            return {k: ToolOutputSchema._shorten_strings(v, max_length) for k, v in value.items()}
+        return value
+
+    @staticmethod
+    def _limit_lists(value, max_items: int):
+        if isinstance(value, list):
+            return [ToolOutputSchema._limit_lists(v, max_items) for v in value[:max_items]]
+        if isinstance(value, dict):
+            return {k: ToolOutputSchema._limit_lists(v, max_items) for k, v in value.items()}
+        return value
+
+    @staticmethod
+    def _drop_largest_field(value) -> bool:
+        """Remove the largest scalar field (or empty container) of the tree, False if none."""
+        largest, size = None, -1
+        stack = [value]
+        while stack:
+            node = stack.pop()
+            items = node.items() if isinstance(node, dict) else enumerate(node)
+            for key, item in items:
+                if isinstance(item, (dict, list)) and item:
+                    stack.append(item)
+                elif len(json.dumps(item)) > size:
+                    largest, size = (node, key), len(json.dumps(item))
+        if largest is None:
+            return False
+        del largest[0][largest[1]]
+        return True
+
+    def compact(self, value) -> str:
+        """
+        Project `value` and serialize it within the character budget. The result is always
+        valid JSON: long strings are shortened first, then lists, then the largest fields are
+        dropped.
+        """
+        value = self._select(value, self.fields)
+        text = json.dumps(value)
+        if self.max_chars is None or len(text) <= self.max_chars:
+            return text
+        # Shorten the longest strings (descriptions, biographies) before cutting the structure
+        max_length = 512
+        while len(text) > self.max_chars and max_length >= 64:
+            shortened = self._shorten_strings(value, max_length)
+            text = json.dumps(shortened)
+            max_length //= 2
+        if len(text) <= self.max_chars:
+            return text
+        # Let the model know the result is incomplete
+        if isinstance(shortened, dict):
+            shortened["truncated"] = True
+            text = json.dumps(shortened)
+        max_items = max((len(v) for v in self._lists(shortened)), default=0)
+        while len(text) > self.max_chars and max_items > 1:
+            max_items //= 2
+            shortened = self._limit_lists(shortened, max_items)
+            text = json.dumps(shortened)
+        while len(text) > self.max_chars and isinstance(shortened, (dict, list)):
+            if not self._drop_largest_field(shortened):
+                break
+            text = json.dumps(shortened)
+        return text
+
+    @staticmethod
+    def _lists(value):
+        """Yield every list of the tree."""
+        if isinstance(value, list):
+            yield value
+            for item in value:
+                yield from ToolOutputSchema._lists(item)
+        elif isinstance(value, dict):
+            for item in value.values():
+                yield from ToolOutputSchema._lists(item)
+
 
 class AgentTool:
     """
@@ -36,3 +194,33 @@ class AgentTool:
     """
     The actual function to be called upon
     """
+
+    async_executable: Callable | None = None
+    """
+    Optional coroutine function with the same parameters, used by `ChatAgent.ainvoke` instead of
+    running `executable` on a worker thread
+    """
+
+    output_schema: ToolOutputSchema | None = None
+    """
+    How to compact the function's output before it is added to the chat history, None to keep
+    the full JSON
+    """
+
+    idempotent: bool = False
+    """
+    Whether calls with the same arguments return the same result without side effects, so
+    `ChatAgent` may memoize them and coalesce concurrent identical calls across sessions
+    """
+
+    cache_ttl: float | None = None
+    """
+    Seconds the result of an idempotent call is reused, None to only coalesce concurrent calls
+    """
+
+    cache_key: Callable | None = None
+    """
+    Optional function of the tool's arguments returning a hashable key, so that equivalent
+    arguments share results (e.g. `query_key`). An empty key disables caching for the call.
+    Defaults to the arguments themselves
+    """
@@ -0,0 +1,138 @@
+import argparse
+import logging
+import os
+from collections import OrderedDict
+
+# The tokenizer is shipped with the app instead of being downloaded from the Hub on first use,
+# export it once with `python -m musezen.generative_components.arctic_tokenizer`
+DEFAULT_TOKENIZER_NAME = "huggyllama/llama-7b"
+DEFAULT_TOKENIZER_PATH = os.path.join(os.path.dirname(__file__), "assets", "tokenizer.json")
+# Conservative characters per token when no tokenizer is available at all, English prose
+# averages about 4 with the Llama tokenizer
+FALLBACK_CHARS_PER_TOKEN = 3
+# Messages are tokenized on their own, merges at the start of a piece may differ from the ones
+# in the joined prompt by a few tokens
+BOUNDARY_SLACK_TOKENS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def export_tokenizer(name: str = DEFAULT_TOKENIZER_NAME, path: str = DEFAULT_TOKENIZER_PATH):
+    """Download a Hub tokenizer once and save its fast (Rust) tokenizer as a single JSON file."""
+    from transformers import AutoTokenizer
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    AutoTokenizer.from_pretrained(name).backend_tokenizer.save(path)
+
+
+def load_tokenizer(path: str | None = None):
+    """
+    Load the bundled fast tokenizer, without importing transformers or touching the network.
+
+    Args:
+        path (str | None, optional): The tokenizer JSON. Defaults to the ARCTIC_TOKENIZER_PATH
+            environment variable, or the bundled asset.
+
+    Returns:
+        tokenizers.Tokenizer | None: The tokenizer, or None if the asset is missing.
+    """
+    path = path or os.environ.get("ARCTIC_TOKENIZER_PATH", DEFAULT_TOKENIZER_PATH)
+    if not os.path.exists(path):
+        logger.warning("No tokenizer at %s, token counts are estimated", path)
+        return None
+    from tokenizers import Tokenizer
+
+    return Tokenizer.from_file(path)
+
+
+def upper_bound_tokens(text: str) -> int:
+    """
+    A bound no byte-level BPE/SentencePiece tokenization can exceed: every token covers at least
+    one UTF-8 byte, plus the dummy prefix the Llama tokenizer may add.
+    """
+    return len(text.encode()) + 1
+
+
+def estimate_tokens(text: str) -> int:
+    """A conservative token count of `text` without a tokenizer."""
+    return -(-len(text) // FALLBACK_CHARS_PER_TOKEN)
+
+
+class ArcticPromptBuilder:
+    """
+    Renders chat messages into the `<|im_start|>` prompt format and counts its tokens
+    incrementally.
+
+    The rendered text and token count of each message are cached, so a new turn only tokenizes
+    the new messages, and only if the cheap upper bound says the prompt might not fit.
+    """
+
+    def __init__(self, tokenizer=None, max_cached_messages: int = 4096):
+        """
+        Args:
+            tokenizer (tokenizers.Tokenizer | None, optional): Exact counts, see
+                `load_tokenizer`. Defaults to None, estimating conservatively.
+            max_cached_messages (int, optional): Size of the per-message LRU. Defaults to 4096.
+        """
+        self.tokenizer = tokenizer
+        self.max_cached_messages = max_cached_messages
+        # (role, content) -> [rendered text, upper bound, exact count or None]
+        self._messages = OrderedDict()
+
+    @staticmethod
+    def render(message: dict) -> str:
+        role = "user" if message["role"] == "user" else "assistant"
+        return f"<|im_start|>{role}\n" + message["content"] + "<|im_end|>"
+
+    def _entry(self, message: dict) -> list:
+        key = (message["role"], message["content"])
+        entry = self._messages.get(key)
+        if entry is None:
+            text = self.render(message)
+            entry = self._messages[key] = [text, upper_bound_tokens(text), None]
+            if len(self._messages) > self.max_cached_messages:
+                self._messages.popitem(last=False)
+        else:
+            self._messages.move_to_end(key)
+        return entry
+
+    def _count(self, entry: list) -> int:
+        if entry[2] is None:
+            if self.tokenizer is not None:
+                # Pieces are joined by newlines, which count as well
+                ids = self.tokenizer.encode(entry[0] + "\n", add_special_tokens=False).ids
+                entry[2] = len(ids) + BOUNDARY_SLACK_TOKENS
+            else:
+                entry[2] = estimate_tokens(entry[0] + "\n") + BOUNDARY_SLACK_TOKENS
+        return entry[2]
+
+    def build(self, messages: list[dict], limit: int | None = None) -> tuple[str, int]:
+        """
+        Render the prompt and count its tokens.
+
+        Args:
+            messages (list[dict]): The chat messages.
+            limit (int | None, optional): When the upper bound is below it, the bound is
+                returned without tokenizing anything. Defaults to None, always counting.
+
+        Returns:
+            tuple[str, int]: The prompt, and a conservative token count: the upper bound, or
+                the per-message counts (estimates without a tokenizer) plus a slack for the
+                merges across messages.
+        """
+        entries = [self._entry(message) for message in messages]
+        prompt = "\n".join([entry[0] for entry in entries] + ["<|im_start|>assistant", ""])
+        tail = upper_bound_tokens("<|im_start|>assistant\n")
+        bound = sum(entry[1] for entry in entries) + tail
+        if limit is not None and bound < limit:
+            return prompt, bound
+        return prompt, sum(self._count(entry) for entry in entries) + tail
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bundle the tokenizer used by ArcticClient.")
+    parser.add_argument("--name", default=DEFAULT_TOKENIZER_NAME)
+    parser.add_argument("--output", default=DEFAULT_TOKENIZER_PATH)
+    args = parser.parse_args()
+    export_tokenizer(args.name, args.output)
+    print(f"Saved {args.name} to {args.output}")
@@ -0,0 +1,108 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from musezen.external_integrations.ArtsyAPI import get_client
+from musezen.generative_components.tool_artsy import find_gene
+
+
+class PrefetchJob:
+    """The prefetch of one classified upload, cancelled when the upload changes."""
+
+    def __init__(self, style: str, budget: int):
+        self.style = style
+        self.budget = budget
+        self.requests = 0
+        self.errors = 0
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Stop issuing requests; the ones already in flight still land in the cache."""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def _take(self) -> bool:
+        """Reserve one request of the budget, False if cancelled or exhausted."""
+        with self._lock:
+            if self.cancelled or self.requests >= self.budget:
+                return False
+            self.requests += 1
+            return True
+
+
+class StylePrefetcher:
+    """
+    Warms the Artsy response cache for a predicted painting style while the user is still
+    typing, so the first `search_gene`/`fetch_links` call of the next turn is a cache hit.
+
+    For a style it fetches the matching gene, the gene's artists, and the first-level API links
+    of the gene and of the first `max_artists` artists. The thread pool is shared by every
+    session, bounding the concurrent requests, and each job stops after `budget` requests.
+    """
+
+    def __init__(self, max_workers: int = 4, budget: int = 20, max_artists: int = 5):
+        """
+        Args:
+            max_workers (int, optional): Concurrent prefetch requests across all sessions.
+                Defaults to 4.
+            budget (int, optional): Maximum requests per prefetched style. Defaults to 20.
+            max_artists (int, optional): Artists whose links are prefetched. Defaults to 5.
+        """
+        self.budget = budget
+        self.max_artists = max_artists
+        self._pool = ThreadPoolExecutor(max_workers, "artsy-prefetch")
+
+    def prefetch(self, style: str) -> PrefetchJob:
+        """Start prefetching in the background for a `idx_to_class` style name."""
+        job = PrefetchJob(style, self.budget)
+        self._pool.submit(self._run, job)
+        return job
+
+    def _fetch(self, job: PrefetchJob, fetch, *args):
+        if not job._take():
+            return None
+        try:
+            return fetch(*args)
+        except Exception:
+            # Prefetching is best effort, the tool call will surface the error if it matters
+            with job._lock:
+                job.errors += 1
+            return None
+
+    @staticmethod
+    def _api_links(record: dict, base_url: str) -> list[str]:
+        """The non-templated API links of a record, except the record itself."""
+        return [
+            link["href"]
+            for name, link in record.get("_links", {}).items()
+            if name != "self"
+            and isinstance(link, dict)
+            and not link.get("templated")
+            and link.get("href", "").startswith(base_url)
+        ]
+
+    def _run(self, job: PrefetchJob):
+        client = get_client(
+            os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET")
+        )
+        # Style names are like "Pop_Art", the model asks for the gene as "Pop Art"
+        gene = self._fetch(job, find_gene, job.style.replace("_", " "))
+        if gene is None:
+            return
+        links = self._api_links(gene, client.base_url)
+        artists_link = gene.get("_links", {}).get("artists", {}).get("href")
+        if artists_link in links:
+            links.remove(artists_link)
+            page = self._fetch(job, client.fetch_link, artists_link)
+            for artist in (page or {}).get("_embedded", {}).get("artists", [])[
+                : self.max_artists
+            ]:
+                links.extend(self._api_links(artist, client.base_url))
+        for link in dict.fromkeys(links):
+            if job.cancelled or job.requests >= job.budget:
+                break
+            self._pool.submit(self._fetch, job, client.fetch_link, link)
@@ -1,29 +1,69 @@
-from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import replicate
 import os
 import streamlit as st
-from transformers import AutoTokenizer
+
+from musezen.generative_components.arctic_tokenizer import (
+    ArcticPromptBuilder,
+    estimate_tokens,
+    load_tokenizer,
+)
+from musezen.generative_components.llm_client_base import LLMClient
+
+# Token limit of the prompt sent to Arctic
+MAX_PROMPT_TOKENS = 3072
+REFUSAL_MESSAGE = "I'm sorry, I cannot help with that"
+# Characters of new response text between two safety checks of a streamed response
+SAFETY_CHUNK_CHARS = 400
+
+# Llama Guard calls made alongside generation, shared by all sessions
+_safety_pool = ThreadPoolExecutor(8, "safety-check")
+
+
+class UnsafeResponseError(Exception):
+    """
+    Raised by a pipelined response when the prompt or a chunk of the response is flagged. The
+    caller should retract the tokens it already displayed and show `message` instead.
+    """
+
+    def __init__(self, message: str = REFUSAL_MESSAGE):
+        super().__init__(message)
+        self.message = message
 
 
 @st.cache_resource(show_spinner=False)
 def get_tokenizer():
     """Get a tokenizer to make sure we're not sending too much text
-    text to the Model. Eventually we will replace this with ArcticTokenizer
+    text to the Model. Eventually we will replace this with ArcticTokenizer.
+    Loaded from the bundled asset, so a cold start needs no network.
     """
-    return AutoTokenizer.from_pretrained("huggyllama/llama-7b")
+    return load_tokenizer()
+
+
+@st.cache_resource(show_spinner=False)
+def get_prompt_builder():
+    """Shared prompt builder, its per-message token counts are reused across sessions"""
+    return ArcticPromptBuilder(get_tokenizer())
 
 
 def get_num_tokens(prompt: str):
     """Get the number of tokens in a given prompt"""
     tokenizer = get_tokenizer()
-    tokens = tokenizer.tokenize(prompt)
-    return len(tokens)
+    if tokenizer is None:
+        return estimate_tokens(prompt)
+    return len(tokenizer.encode(prompt, add_special_tokens=False).ids)
 
 
 def check_safety(prompt: str, response: str, disable=False) -> bool:
     if disable:
         return True
+    # Verdicts are cached, repeated prompts (and prompt/response pairs) are not sent again
+    return _llama_guard(prompt, response)
+
 
+@lru_cache(maxsize=4096)
+def _llama_guard(prompt: str, response: str) -> bool:
     output = replicate.run(
         "meta/meta-llama-guard-2-8b:b063023ee937f28e922982abdbf97b041ffe34ad3b35a53d33e1d74bb19b36c4",
         input={
@@ -38,18 +78,6 @@ def check_safety(prompt: str, response: str, disable=False) -> bool:
         return True
 
 
-class LLMClient(ABC):
-    @abstractmethod
-    def send_message(
-        self,
-        model: str,
-        messages: list[dict],
-        max_tokens: int | None = None,
-        tools: list[dict] | None = None,
-    ):
-        raise NotImplementedError("This method must be implemented in the child class!")
-
-
 class ArcticClient(LLMClient):
 
     def __init__(
@@ -71,6 +99,7 @@ class ArcticClient(LLMClient):
         tools: list[dict] = None,
         temperature: float = 0.3,
         top_p: float = 0.9,
+        pipelined: bool = False,
     ) -> list[str]:
         """
         Send a message to the OpenAI API.
@@ -79,28 +108,20 @@ class ArcticClient(LLMClient):
             model (str): Name of the model used
             messages (list[dict]): A list of messages.
             tools (list[dict]): A list of function specifications
+            pipelined (bool, optional): Stream the tokens as they are generated while the
+                safety checks run alongside, see `_pipelined`. Defaults to False.
 
         Returns:
             Iterable: The streaming response from the API.
         """
-        prompt = []
-        for dict_message in messages:
-            if dict_message["role"] == "user":
-                prompt.append(
-                    "<|im_start|>user\n" + dict_message["content"] + "<|im_end|>"
-                )
-            else:
-                prompt.append(
-                    "<|im_start|>assistant\n" + dict_message["content"] + "<|im_end|>"
-                )
-
-        prompt.append("<|im_start|>assistant")
-        prompt.append("")
-        prompt_str = "\n".join(prompt)
-
-        if get_num_tokens(prompt_str) >= 3072:
+        # Only messages not seen before are rendered and, if the prompt might not fit, tokenized
+        prompt_str, num_tokens = get_prompt_builder().build(messages, limit=MAX_PROMPT_TOKENS)
+        if num_tokens >= MAX_PROMPT_TOKENS:
             raise OverflowError
 
+        if pipelined:
+            return self._pipelined(model, prompt_str, messages[-1]["content"], temperature, top_p)
+
         output = replicate.run(
             model,
             input={
@@ -110,6 +131,8 @@ class ArcticClient(LLMClient):
                 "top_p": top_p,
             },
         )
+        # The output may be a one-shot iterator, keep the tokens to return them after the check
+        output = list(output)
 
         is_safe = check_safety(
             prompt=messages[-1]["content"],
@@ -118,4 +141,56 @@ class ArcticClient(LLMClient):
         if is_safe:
             return output
         else:
-            return ["I'm sorry, I cannot help with that"]
+            return [REFUSAL_MESSAGE]
+
+    def _pipelined(
+        self, model: str, prompt_str: str, user_prompt: str, temperature: float, top_p: float
+    ):
+        """
+        Yield the generated tokens immediately, moderating them on the side.
+
+        The user prompt is classified while Arctic generates, and the response so far is checked
+        every SAFETY_CHUNK_CHARS characters, one check at a time: a chunk completed while the
+        previous check is still running is covered by the next one. A flagged verdict raises
+        `UnsafeResponseError` as soon as it is known. After generation only the prompt check and
+        the check of the whole response are waited for.
+        """
+        prompt_check = _safety_pool.submit(check_safety, user_prompt, "")
+        # The latest check of the response, and how much of the response it covers
+        response_check, checked = None, 0
+
+        def raise_if_flagged(check, wait: bool):
+            if check is None or check.cancelled():
+                return
+            if (wait or check.done()) and not check.result():
+                raise UnsafeResponseError()
+
+        output = replicate.run(
+            model,
+            input={
+                "prompt": prompt_str,
+                "prompt_template": r"{prompt}",
+                "temperature": temperature,
+                "top_p": top_p,
+            },
+        )
+        response = ""
+        for token in output:
+            raise_if_flagged(prompt_check, wait=False)
+            raise_if_flagged(response_check, wait=False)
+            response += token
+            if len(response) - checked >= SAFETY_CHUNK_CHARS and (
+                response_check is None or response_check.done()
+            ):
+                response_check = _safety_pool.submit(check_safety, user_prompt, response)
+                checked = len(response)
+            yield token
+        if len(response) > checked:
+            raise_if_flagged(response_check, wait=False)
+            if response_check is not None:
+                # Replaced by the check of the whole response: dropped if still queued, and
+                # not waited for if already running
+                response_check.cancel()
+            response_check = _safety_pool.submit(check_safety, user_prompt, response)
+        raise_if_flagged(prompt_check, wait=True)
+        raise_if_flagged(response_check, wait=True)
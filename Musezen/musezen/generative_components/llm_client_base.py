@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 
@@ -10,4 +11,32 @@ class LLMClient(ABC):
         max_tokens: int | None = None,
         tools: list[dict] | None = None,
     ):
-        pass
\ No newline at end of file
+        pass
+
+    async def asend_message(
+        self,
+        model: str,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        tools: list[dict] | None = None,
+    ):
+        """
+        Async variant of `send_message`. Clients with a native async SDK should override it,
+        the default runs the blocking call on a worker thread.
+        """
+        return await asyncio.to_thread(
+            self.send_message, model, messages, max_tokens=max_tokens, tools=tools
+        )
+
+    def stream_message(
+        self,
+        model: str,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        tools: list[dict] | None = None,
+    ):
+        """
+        Streaming variant of `send_message`, yielding OpenAI-style `ChatCompletionChunk`s whose
+        deltas carry content and tool call fragments.
+        """
+        raise NotImplementedError("This client does not support streaming!")
@@ -1,6 +1,6 @@
 from musezen.generative_components.llm_client_base import LLMClient
-from openai.types.chat import ChatCompletion
-from openai import OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from openai import AsyncOpenAI, OpenAI
 
 
 class OpenAIClient(LLMClient):
@@ -24,6 +24,8 @@ class OpenAIClient(LLMClient):
             # default_headers={"Helicone-Auth": f"Bearer {helicone_api_key}"},
             # base_url=base_url,
         )
+        # Shares no connections with the sync client; used by ChatAgent.ainvoke
+        self.async_client = AsyncOpenAI(api_key=api_key)
 
     def send_message(
         self,
@@ -62,4 +64,76 @@ class OpenAIClient(LLMClient):
                 max_tokens=max_tokens,
             )
 
-        return response
\ No newline at end of file
+        return response
+
+    def stream_message(
+        self,
+        model: str,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        tools: list[dict] | None = None,
+    ):
+        """
+        Send a message to the OpenAI API and yield the response chunks as they are generated.
+
+        Args:
+            model (str): The model name.
+            messages (list[dict]): A list of messages.
+            max_tokens (int, optional): The maximum number of tokens to generate. Defaults to None.
+            tools (dict, optional): A dictionary of tools to use. Defaults to None.
+
+        Yields:
+            ChatCompletionChunk: Content and tool call deltas.
+        """
+        if tools:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                max_tokens=max_tokens,
+                stream=True,
+            )
+        else:
+            stream = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+        chunk: ChatCompletionChunk
+        for chunk in stream:
+            yield chunk
+
+    async def asend_message(
+        self,
+        model: str,
+        messages: list[dict],
+        max_tokens: int | None = None,
+        tools: list[dict] | None = None,
+    ) -> ChatCompletion:
+        """
+        Send a message to the OpenAI API without blocking the event loop.
+
+        Args:
+            model (str): The model name.
+            messages (list[dict]): A list of messages.
+            max_tokens (int, optional): The maximum number of tokens to generate. Defaults to None.
+            tools (dict, optional): A dictionary of tools to use. Defaults to None.
+
+        Returns:
+            ChatCompletion: The response from the API.
+        """
+        if tools:
+            return await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                max_tokens=max_tokens,
+            )
+        return await self.async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+        )
@@ -1,8 +1,10 @@
 import streamlit as st
 import os
+import requests
 
-from musezen.external_integrations.ArtsyAPI import ArtsyAPI
-from musezen.generative_components.agent_tools import AgentTool
+from musezen.external_integrations.ArtsyAPI import get_client
+from musezen.external_integrations.ArtsyCatalog import get_catalog
+from musezen.generative_components.agent_tools import AgentTool, ToolOutputSchema, query_key
 
 
 SEARCH_GENE_DESCRIPTION = """
@@ -16,16 +18,40 @@ A 'gene' refers to a distinctive characteristic or attribute that defines an art
 """
 
 
+def find_gene(query: str) -> dict:
+    """
+    Look up the gene matching a query: from the local mirror if it is known (which also resolves
+    typos and aliases), otherwise from the API by slug, falling back to Artsy's search.
+    """
+    catalog = get_catalog()
+    matches = catalog.resolve(query, "genes", limit=1) if catalog else []
+    if matches:
+        return catalog.get("genes", matches[0]["id"])
+
+    client = get_client(
+        os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET")
+    )
+    try:
+        res = client.genes(query.lower().replace(" ", "-"))
+    except requests.HTTPError:
+        # The slug guess missed, let Artsy's search find the gene instead
+        results = client.fetch_all_results(query, type_filter="gene", max_results=1)
+        results = results.get("_embedded", {}).get("results", [])
+        if not results:
+            raise
+        res = client.fetch_link(results[0]["_links"]["self"]["href"])
+    if catalog:
+        catalog.upsert("genes", [res])
+    return res
+
+
 class SearchGene(AgentTool):
     def search_gene(query: str):
         """
         Search for a gene by query
         """
         st.write("Searching for art with characteristics of", query)
-        client = ArtsyAPI(
-            os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET")
-        )
-        res = client.genes(query.lower().replace(" ", "-"))
+        res = find_gene(query)
         # st.write(res)
         st.write("Finished!")
         return res
@@ -52,6 +78,40 @@ class SearchGene(AgentTool):
 
     executable = search_gene
 
+    # Read-only lookups, "Pop Art" and "pop-art" resolve to the same gene
+    idempotent = True
+    cache_ttl = 10 * 60
+    cache_key = lambda query: query_key(query)
+
+    output_schema = ToolOutputSchema(
+        fields=[
+            "name",
+            "display_name",
+            "description",
+            "image_versions",
+            "_links.thumbnail.href",
+            "_links.image.href",
+            "_links.permalink.href",
+            "_links.artists.href",
+            "_links.artworks.href",
+        ],
+        max_tokens=1500,
+    )
+
+
+def _artist_search_result(artist: dict) -> dict:
+    """Reshape a mirrored artist record like an entry of the live search results."""
+    links = artist.get("_links", {})
+    return {
+        "type": "artist",
+        "og_type": "artist",
+        "title": artist["name"],
+        "description": artist.get("biography") or None,
+        "_links": {
+            key: links[key] for key in ("self", "permalink", "thumbnail") if key in links
+        },
+    }
+
 
 SEARCH_ARTIST_DESCRIPTION = """
 This function returns information for an artist that matches the given query including:
@@ -71,7 +131,14 @@ class SearchArtist(AgentTool):
         Search for a gene by query
         """
         st.write("Searching for artists:", query)
-        client = ArtsyAPI(
+        catalog = get_catalog()
+        matches = catalog.resolve(query, "artists", limit=10) if catalog else []
+        if matches:
+            results = [_artist_search_result(catalog.get("artists", m["id"])) for m in matches]
+            st.write("Finished!")
+            return {"total_count": len(results), "_embedded": {"results": results}}
+
+        client = get_client(
             os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET")
         )
         res = client.fetch_all_results(query=query, type_filter="artist")
@@ -101,6 +168,25 @@ class SearchArtist(AgentTool):
 
     executable = search_artist
 
+    idempotent = True
+    cache_ttl = 10 * 60
+    cache_key = lambda query: query_key(query)
+
+    output_schema = ToolOutputSchema(
+        fields=[
+            "total_count",
+            "_embedded.results.type",
+            "_embedded.results.og_type",
+            "_embedded.results.title",
+            "_embedded.results.description",
+            "_embedded.results._links.self.href",
+            "_embedded.results._links.permalink.href",
+            "_embedded.results._links.thumbnail.href",
+        ],
+        max_items=10,
+        max_tokens=1500,
+    )
+
 
 FETCH_APILINK_DESCRIPTION = """
 Responses from the Artsy API requests usually contains various API links. This function fetches the response when given one of those links.
@@ -113,7 +199,7 @@ class FetchAPILinks(AgentTool):
         Fetch the links for the Artsy API
         """
         st.write("Fetching responses from other further links...")
-        client = ArtsyAPI(
+        client = get_client(
             os.environ.get("ARTSY_CLIENT_ID"), os.environ.get("ARTSY_CLIENT_SECRET")
         )
         res = client.fetch_link(api_link)
@@ -141,4 +227,10 @@ class FetchAPILinks(AgentTool):
 
     name = description["function"]["name"]
 
-    executable = fetch_links
\ No newline at end of file
+    executable = fetch_links
+
+    idempotent = True
+    cache_ttl = 10 * 60
+
+    # Linked resources vary, so keep their structure and only trim the HAL boilerplate
+    output_schema = ToolOutputSchema(exclude=["curies"], max_items=10, max_tokens=2000)
@@ -0,0 +1,61 @@
+import pytest
+
+from musezen.generative_components.agent_response_cache import (
+    SemanticResponseCache,
+    normalize_question,
+    same_terms,
+)
+
+MODEL = "snowflake/snowflake-arctic-instruct"
+
+
+def cached_answer(cached_question: str, question: str) -> str | None:
+    cache = SemanticResponseCache()
+    cache.put(cached_question, MODEL, f"answer to {cached_question}")
+    hit = cache.get(question, MODEL)
+    return hit and hit["response"]
+
+
+@pytest.mark.parametrize(
+    "cached_question, question",
+    [
+        (
+            "Who are the most famous painters of German Expressionism?",
+            "Who are the most famous painters of German Impressionism?",
+        ),
+        (
+            "Which museums have the best Abstract Expressionism collections?",
+            "Which museums have the best Abstract Impressionism collections?",
+        ),
+        ("Show me Neo-Expressionism paintings", "Show me Neo-Impressionism paintings"),
+        ("Tell me about Monet", "Tell me about Manet"),
+        ("Who is 草間彌生?", "Who is 葛飾北斎?"),
+        ("Who is Айвазовский?", "Who is Кандинский?"),
+    ],
+)
+def test_different_terms_miss(cached_question, question):
+    assert cached_answer(cached_question, question) is None
+
+
+@pytest.mark.parametrize(
+    "cached_question, question",
+    [
+        ("What is Impressionism?", "tell me about impressionism"),
+        ("What is Impressionism?", "what is impresionism"),
+        ("Who is Albrecht Dürer?", "who is albrecht durer"),
+        ("Who is 草間彌生?", "草間彌生"),
+    ],
+)
+def test_same_question_hits(cached_question, question):
+    assert cached_answer(cached_question, question) == f"answer to {cached_question}"
+
+
+def test_normalize_question_keeps_non_latin_letters():
+    assert normalize_question("Who is 草間彌生?") == "草間彌生"
+    assert normalize_question("Tell me about Айвазовский!") == "айвазовский"
+
+
+def test_same_terms_requires_every_content_word():
+    assert not same_terms("german impressionism", "german expressionism")
+    assert same_terms("impressionism german", "german impressionism")
+    assert same_terms("german impresionism", "german impressionism")
@@ -0,0 +1,35 @@
+import json
+from types import SimpleNamespace
+
+from musezen.generative_components.agent import ChatAgent
+from musezen.generative_components.agent_tool_cache import ToolResultCache
+from musezen.generative_components.agent_tools import AgentTool, query_key
+
+
+def test_query_key_keeps_non_latin_letters():
+    assert query_key("  Pop-Art! ") == query_key("pop art") == "pop art"
+    keys = {query_key(name) for name in ("草間彌生", "葛飾北斎", "Айвазовский")}
+    assert len(keys) == 3 and "" not in keys
+
+
+def test_calls_without_a_key_are_not_cached():
+    calls = []
+
+    class Lookup(AgentTool):
+        name = "lookup"
+        description = {}
+        idempotent = True
+        cache_ttl = 60
+        cache_key = lambda query: query_key(query)
+
+        def executable(query):
+            calls.append(query)
+            return {"query": query}
+
+    agent = ChatAgent(None, [], [Lookup], tool_cache=ToolResultCache())
+    for query in ("!!!", "???", "Pop Art", "pop-art"):
+        function = SimpleNamespace(name="lookup", arguments=json.dumps({"query": query}))
+        tool_call = SimpleNamespace(id=query, function=function)
+        agent.function_calling([tool_call])
+    assert calls == ["!!!", "???", "Pop Art"]
+    assert json.loads(agent.chat_history[1]["content"]) == {"query": "???"}